@@ -9,7 +9,7 @@ from google.genai import types
 def get_current_price(symbol: str) -> dict:
     """Get the latest trade/quote fields for a symbol from the Zerodha-like API.
 
-    This function is expected to call `https://zerodha-production-04a6.up.railway.app/api/stocks/{symbol}`
+    This function is expected to call `https://zerodha-production-04a6.up.railway.app/api/stocks/{symbol}/quote?mode=ohlc`
     and normalize the `quote` and related top-level fields into a compact shape.
 
     Args:
@@ -20,13 +20,15 @@ def get_current_price(symbol: str) -> dict:
         - symbol: str
         - exchange: str  # e.g., "NSE"
         - last_price: float  # from quote.last_price
-        - last_trade_time: str  # from quote.last_trade_time, original timezone
+        - last_trade_time: str | None  # from quote.last_trade_time when the quote came from a live tick
         - ohlc: Dict[str, float]  # from quote.ohlc: {open, high, low, close}
+        - change: float | None  # last_price minus previous close
+        - change_percent: float | None
         - source_url: str  # the URL used for the request
         - raw_quote: Dict[str, Any]  # full provider `quote` object for debugging
     """
     base_url = "https://zerodha-production-04a6.up.railway.app/api/stocks/"
-    url = f"{base_url}{symbol}"
+    url = f"{base_url}{symbol}/quote?mode=ohlc"
     try:
         response = requests.get(url, timeout=15)
         response.raise_for_status()
@@ -51,6 +53,8 @@ def get_current_price(symbol: str) -> dict:
             "low": ohlc.get("low"),
             "close": ohlc.get("close"),
         },
+        "change": quote.get("change"),
+        "change_percent": quote.get("change_percent"),
         "source_url": url,
         "raw_quote": quote,
     }
@@ -277,7 +281,7 @@ def get_order_book(symbol: str, depth: int = 5) -> dict:
         - as_of: str  # timestamp if available in provider payload
     """
     base_url = "https://zerodha-production-04a6.up.railway.app/api/stocks/"
-    url = f"{base_url}{symbol}"
+    url = f"{base_url}{symbol}/quote?mode=full"
     try:
         response = requests.get(url, timeout=15)
         response.raise_for_status()
@@ -14,17 +14,31 @@ import traceback
 from email.utils import parsedate_to_datetime
 
 # Third-party imports
-from flask import Flask, jsonify, request
+import gevent
+from gevent.pool import Pool
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import websockets
 from kiteconnect import KiteConnect, KiteTicker
 from dotenv import load_dotenv
 import requests
 from supabase import create_client, Client
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import pyotp
 import base64
 from agent import answer
+from candle_format import (MSGPACK_MIMETYPES, candles_to_columns, format_candle_dates, msgpack_available,
+                           packb)
+from candle_store import CandleStore
+from historical import INTRADAY_INTERVALS, fetch_chunks, plan_chunks
+from instrument_store import ExchangeCatalogs
+from kite_scheduler import (ENDPOINT_DEFAULT, ENDPOINT_HISTORICAL, ENDPOINT_QUOTE, PRIORITY_BACKGROUND,
+                            KiteScheduler)
+from resample import PERIODS, LevelCache, period_end
+from response_cache import HistoricalCache, PageCache
+from tick_state import TickState, TickSubscriptions
+from quotes import (MODE_FIELDS, MODE_FULL, MODE_LTP, MODE_OHLC, QUOTE_MODES, QuoteCoalescer,
+                    QuoteService, add_change_fields, project_quote, quote_key, quote_mode_for_fields)
 import tempfile
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -69,12 +83,101 @@ if not API_KEY or not ACCESS_TOKEN:
 kite = KiteConnect(api_key=API_KEY)
 kite.set_access_token(ACCESS_TOKEN)
 
-# Store latest tick data
-latest_ticks = {}
-
-# Cache for instruments data
-instruments_cache = {}
-instruments_cache_timestamp = None
+# Store latest tick data, tracking which instruments changed since the last broadcast
+latest_ticks = TickState()
+# Changed ticks go out every TICK_EMIT_INTERVAL; everything is re-sent every TICK_SNAPSHOT_INTERVAL
+TICK_EMIT_INTERVAL = float(os.getenv('TICK_EMIT_INTERVAL', 0.1))  # seconds
+TICK_SNAPSHOT_INTERVAL = float(os.getenv('TICK_SNAPSHOT_INTERVAL', 5))  # seconds
+# Socket.IO clients receive ticks only for instruments they subscribed to (one room each)
+tick_subscriptions = TickSubscriptions()
+ALL_TICKS_ROOM = 'ticks:all'
+
+# Every Kite REST call goes through one scheduler that keeps each endpoint class under its rate limit.
+# Kite limits the whole API key but each gunicorn worker has its own scheduler, so split the limits per worker.
+KITE_RATE_LIMIT_WORKERS = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+kite_scheduler = KiteScheduler({
+    ENDPOINT_QUOTE: float(os.getenv('KITE_QUOTE_RATE_LIMIT', 1)) / KITE_RATE_LIMIT_WORKERS,  # requests per second
+    ENDPOINT_HISTORICAL: float(os.getenv('KITE_HISTORICAL_RATE_LIMIT', 3)) / KITE_RATE_LIMIT_WORKERS,
+    ENDPOINT_DEFAULT: float(os.getenv('KITE_DEFAULT_RATE_LIMIT', 10)) / KITE_RATE_LIMIT_WORKERS,
+})
+kite_historical_data = kite_scheduler.wrap(ENDPOINT_HISTORICAL, kite.historical_data)
+
+def fetch_candles(instrument_token, interval, from_dt, to_dt):
+    """Fetch candles for an inclusive range from Kite, split into the chunks Kite allows for the interval"""
+    if interval == 'day':
+        return fetch_daily_full(instrument_token, from_dt.date(), to_dt.date())
+    return fetch_range_full(instrument_token, interval, from_dt, to_dt)
+
+# Historical candles persist locally; only gaps and today's open session are fetched from Kite
+CANDLE_STORE_PATH = os.getenv(
+    'CANDLE_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'candles.sqlite3')
+)
+candle_store = CandleStore(CANDLE_STORE_PATH, fetch_candles)
+
+def load_daily_candles(instrument_token, start_date, end_date):
+    return candle_store.get(instrument_token, 'day', start_date, end_date)
+
+# Week/month/quarter/year bars are aggregated from stored daily candles and kept per instrument
+RESAMPLE_CACHE_INSTRUMENTS = int(os.getenv('RESAMPLE_CACHE_INSTRUMENTS', 256))
+candle_levels = LevelCache(load_daily_candles, max_instruments=RESAMPLE_CACHE_INSTRUMENTS)
+
+# Planned chunks of one long historical range fetched at once (the scheduler still paces them)
+HISTORICAL_CHUNK_CONCURRENCY = int(os.getenv('HISTORICAL_CHUNK_CONCURRENCY', 3))
+# Byte-bounded LRU of historical results; closed ranges never expire, ranges with today follow market hours
+historical_cache = HistoricalCache(
+    max_bytes=int(os.getenv('HISTORICAL_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    live_ttl=float(os.getenv('HISTORICAL_CACHE_LIVE_TTL', 30))  # seconds
+)
+# Symbols one bulk historical request may ask for, and how many are fetched at once
+BULK_HISTORICAL_MAX_SYMBOLS = int(os.getenv('BULK_HISTORICAL_MAX_SYMBOLS', 500))
+BULK_HISTORICAL_CONCURRENCY = int(os.getenv('BULK_HISTORICAL_CONCURRENCY', 8))
+# Longest date range one intraday /historical request may ask for
+HISTORICAL_INTRADAY_MAX_DAYS = int(os.getenv('HISTORICAL_INTRADAY_MAX_DAYS', 400))
+
+# Catalog expiry and on-disk snapshot used for warm starts
+INSTRUMENTS_CACHE_TTL = int(os.getenv('INSTRUMENTS_CACHE_TTL', 3600))  # seconds
+INSTRUMENTS_SNAPSHOT_DIR = os.getenv(
+    'INSTRUMENTS_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+)
+
+# Cache for instruments data: columnar per-exchange catalogs, loaded lazily and
+# refreshed stale-while-revalidate with a single in-flight fetch
+instrument_catalogs = ExchangeCatalogs(
+    kite_scheduler.wrap(ENDPOINT_DEFAULT, kite.instruments, priority=PRIORITY_BACKGROUND),
+    ttl=INSTRUMENTS_CACHE_TTL,
+    snapshot_dir=INSTRUMENTS_SNAPSHOT_DIR
+)
+
+# Pre-encoded /api/stocks pages per exchange, dropped whenever the catalog version changes
+STOCKS_PAGE_CACHE_SIZE = int(os.getenv('STOCKS_PAGE_CACHE_SIZE', 512))
+stocks_page_caches = {}
+
+# Quotes come from live ticks when streamed, else a short-TTL cache in front of kite.quote
+QUOTE_TICK_MAX_AGE = float(os.getenv('QUOTE_TICK_MAX_AGE', 5))  # seconds
+QUOTE_CACHE_TTL = float(os.getenv('QUOTE_CACHE_TTL', 3))  # seconds
+# Concurrent kite.quote/ohlc/ltp demands inside this window share one batched call (max 500 instruments)
+QUOTE_BATCH_WINDOW = float(os.getenv('QUOTE_BATCH_WINDOW', 0.005))  # seconds
+# Batches stay open until the scheduler grants a quote token, so a burst queued behind the limit shares one call
+def schedule_quote(send, batch):
+    return kite_scheduler.call(ENDPOINT_QUOTE, send, batch)
+
+quote_coalescers = {
+    MODE_FULL: QuoteCoalescer(kite.quote, window=QUOTE_BATCH_WINDOW, schedule=schedule_quote),
+    MODE_OHLC: QuoteCoalescer(kite.ohlc, window=QUOTE_BATCH_WINDOW, schedule=schedule_quote),
+    MODE_LTP: QuoteCoalescer(kite.ltp, window=QUOTE_BATCH_WINDOW, schedule=schedule_quote),
+}
+quote_coalescer = quote_coalescers[MODE_FULL]
+quote_service = QuoteService(quote_coalescers, ticks=latest_ticks, tick_max_age=QUOTE_TICK_MAX_AGE,
+                             cache_ttl=QUOTE_CACHE_TTL)
+# Large batch-quote requests are split into 500-instrument chunks fetched this many at a time
+BATCH_QUOTES_MAX_SYMBOLS = int(os.getenv('BATCH_QUOTES_MAX_SYMBOLS', 10000))
+BATCH_QUOTES_CONCURRENCY = int(os.getenv('BATCH_QUOTES_CONCURRENCY', 4))
+# get_stock_detail waits this long for Kite; late quotes and history are marked pending
+STOCK_DETAIL_TIME_BUDGET = float(os.getenv('STOCK_DETAIL_TIME_BUDGET', 2.5))  # seconds
+# History fetches in flight at once for /api/wishlist/details
+WISHLIST_HISTORY_CONCURRENCY = int(os.getenv('WISHLIST_HISTORY_CONCURRENCY', 8))
 
 SUPABASE_WISHLIST_ENDPOINT = f'{SUPABASE_URL}/rest/v1/wishlist'
 SUPABASE_HEADERS = {
@@ -83,29 +186,21 @@ SUPABASE_HEADERS = {
     'Content-Type': 'application/json'
 }
 
+def get_instrument_registry(exchange='NSE'):
+    """Get the hash-indexed registry for an exchange's current instrument catalog"""
+    return instrument_catalogs.registry(exchange)
+
 def get_all_instruments():
     """Get all available instruments from NSE"""
-    global instruments_cache, instruments_cache_timestamp
-    
-    # Cache for 1 hour
-    if (instruments_cache_timestamp and 
-        (datetime.now() - instruments_cache_timestamp).seconds < 3600):
-        return instruments_cache
-    
-    try:
-        instruments = kite.instruments("NSE")
-        instruments_cache = instruments
-        instruments_cache_timestamp = datetime.now()
-        print(f"Fetched {len(instruments)} instruments from NSE")
-        return instruments
-    except Exception as e:
-        print(f"Error fetching instruments: {e}")
-        return []
+    return get_instrument_registry().instruments
 
-def get_popular_stocks():
-    """Get list of popular stocks with basic info"""
+# Fields list screens need; kite.ohlc answers them without the depth of a full quote
+LIST_QUOTE_FIELDS = ('last_price', 'change', 'change_percent')
+
+def get_popular_stocks(with_quotes=False):
+    """Get list of popular stocks with basic info, optionally with last price and change"""
     try:
-        instruments = get_all_instruments()
+        registry = get_instrument_registry()
         popular_symbols = [
             "RELIANCE", "TCS", "HDFCBANK", "INFY", "ICICIBANK",
             "HINDUNILVR", "HDFC", "SBIN", "BHARTIARTL", "ITC",
@@ -116,8 +211,9 @@ def get_popular_stocks():
         ]
         
         popular_stocks = []
-        for instrument in instruments:
-            if instrument['tradingsymbol'] in popular_symbols:
+        for symbol in popular_symbols:
+            instrument = registry.get_by_symbol(symbol)
+            if instrument:
                 stock_data = {
                     'symbol': instrument['tradingsymbol'],
                     'name': instrument['name'],
@@ -132,6 +228,18 @@ def get_popular_stocks():
                 }
                 popular_stocks.append(stock_data)
         
+        if with_quotes and popular_stocks:
+            instruments = [registry.get_by_symbol(stock['symbol']) for stock in popular_stocks]
+            try:
+                quotes = quote_service.get_quotes_for_fields(instruments, LIST_QUOTE_FIELDS)
+            except Exception as e:
+                print(f"Error fetching popular stock quotes: {e}")
+                quotes = {}
+            for stock, instrument in zip(popular_stocks, instruments):
+                quote_data = quotes.get(quote_key(instrument), (None, None))[0] or {}
+                for field in LIST_QUOTE_FIELDS:
+                    stock[field] = quote_data.get(field)
+        
         return popular_stocks
     except Exception as e:
         print(f"Error getting popular stocks: {e}")
@@ -144,12 +252,25 @@ def get_stocks():
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 50))
         search = request.args.get('search', '').upper()
+        exchange = request.args.get('exchange', 'NSE').upper()
         
-        instruments = get_all_instruments()
+        try:
+            registry = get_instrument_registry(exchange)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Serve the page straight from its pre-encoded bytes when the catalog is unchanged
+        page_cache = stocks_page_caches.setdefault(exchange, PageCache(STOCKS_PAGE_CACHE_SIZE))
+        cache_key = (search, page, limit)
+        cached = page_cache.get(registry.version, cache_key) if registry.version else None
+        if cached:
+            return _encoded_json_response(*cached)
         
-        # Filter by search term if provided
+        # Filter by search term if provided (ranked, full match list for pagination)
         if search:
-            instruments = [i for i in instruments if search in i['tradingsymbol'] or search in i['name'].upper()]
+            instruments = registry.search(search, limit=None)
+        else:
+            instruments = registry.instruments
         
         # Pagination
         start_idx = (page - 1) * limit
@@ -173,147 +294,162 @@ def get_stocks():
             }
             stocks.append(stock_data)
         
-        return jsonify({
+        payload = {
             'stocks': stocks,
             'total': len(instruments),
             'page': page,
             'limit': limit,
             'has_next': end_idx < len(instruments),
             'has_prev': page > 1
-        })
+        }
+        if not registry.version:
+            return jsonify(payload)
+        body = app.json.dumps(payload).encode('utf-8')
+        return _encoded_json_response(*page_cache.put(registry.version, cache_key, body))
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _encoded_json_response(etag, body):
+    """Wrap pre-encoded JSON in a response that honours If-None-Match"""
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def _historical_options():
+    """Read ?format=columnar and msgpack negotiation (?encoding=msgpack or Accept) for candle payloads"""
+    columnar = request.args.get('format', 'rows').lower() == 'columnar'
+    use_msgpack = (request.args.get('encoding', '').lower() == 'msgpack'
+                   or request.accept_mimetypes.best in MSGPACK_MIMETYPES)
+    return columnar, use_msgpack
+
+def _payload_response(payload, use_msgpack):
+    """Encode a response payload as msgpack or JSON"""
+    if use_msgpack:
+        return Response(packb(payload), mimetype=MSGPACK_MIMETYPES[0])
+    return jsonify(payload)
+
 @app.route('/api/stocks/popular', methods=['GET'])
 def get_popular_stocks_endpoint():
-    """Get popular stocks"""
+    """Get popular stocks; ?quotes=true adds last price and change from kite.ohlc"""
     try:
-        stocks = get_popular_stocks()
+        with_quotes = request.args.get('quotes', 'false').lower() == 'true'
+        stocks = get_popular_stocks(with_quotes)
         return jsonify({'stocks': stocks})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+IST_LABEL_FORMAT = '%A, %d %b %Y %H:%M:%S %Z'
+
+def format_quote_times(quote_data):
+    """Rewrite a quote's timestamp and last_trade_time as IST labels in place"""
+    if not quote_data:
+        return quote_data
+    ist_timezone = pytz.timezone('Asia/Kolkata')
+    for field in ('timestamp', 'last_trade_time'):
+        if field not in quote_data:
+            continue
+        try:
+            original = quote_data[field]
+            if isinstance(original, str):
+                if 'GMT' in original:
+                    original = parsedate_to_datetime(original)
+                else:
+                    original = datetime.fromisoformat(original.replace('Z', '+00:00'))
+            quote_data[field] = original.astimezone(ist_timezone).strftime(IST_LABEL_FORMAT)
+        except Exception as e:
+            print(f"Error converting quote {field}: {e}")
+    return quote_data
+
+@app.route('/api/stocks/<symbol>/quote', methods=['GET'])
+def get_stock_quote(symbol):
+    """Get just the quote for a stock, in the cheapest mode that answers ?fields= or the given ?mode="""
+    try:
+        instrument = get_instrument_registry().get_by_symbol(symbol)
+        if not instrument:
+            return jsonify({"error": "Stock not found"}), 404
+        
+        fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+        mode = request.args.get('mode') or quote_mode_for_fields(fields)
+        if mode not in QUOTE_MODES:
+            return jsonify({"error": f"Invalid mode. Use one of: {', '.join(QUOTE_MODES)}"}), 400
+        
+        quote_data, quote_source = quote_service.get_quote(instrument, mode)
+        if quote_data is None:
+            return jsonify({"error": "Quote not available"}), 404
+        
+        # Ticks and cached full quotes carry more than the mode asked for; trim them to it
+        quote_data = format_quote_times(add_change_fields(quote_data))
+        return jsonify({
+            'symbol': instrument['tradingsymbol'],
+            'exchange': instrument['exchange'],
+            'mode': mode,
+            'quote': project_quote(quote_data, fields or MODE_FIELDS.get(mode)),
+            'quote_source': quote_source,
+            'timestamp': datetime.now(pytz.timezone('Asia/Kolkata')).strftime(IST_LABEL_FORMAT)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/stocks/<symbol>', methods=['GET'])
 def get_stock_detail(symbol):
     """Get detailed information for a specific stock"""
     try:
         # Get instrument details
-        instruments = get_all_instruments()
-        instrument = None
-        
-        for inst in instruments:
-            if inst['tradingsymbol'] == symbol.upper():
-                instrument = inst
-                break
+        instrument = get_instrument_registry().get_by_symbol(symbol)
         
         if not instrument:
             return jsonify({"error": "Stock not found"}), 404
         
-        # Get quote data
+        columnar, use_msgpack = _historical_options()
+        if use_msgpack and not msgpack_available():
+            return jsonify({"error": "msgpack encoding is not available"}), 406
+        
+        token = instrument['instrument_token']
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=30)
+        
+        # Quote (live tick, cache or Kite) and last 30 days of history, issued together
+        # and awaited only for the request's time budget
+        quote_job = gevent.spawn(quote_service.get_quote, instrument)
+        history_job = gevent.spawn(load_candles, token, 'day', start_date.date(), end_date.date())
+        gevent.joinall([quote_job, history_job], timeout=STOCK_DETAIL_TIME_BUDGET)
+        
         quote_data = None
-        try:
-            quote = kite.quote(f"NSE:{symbol.upper()}")
-            if f"NSE:{symbol.upper()}" in quote:
-                quote_data = quote[f"NSE:{symbol.upper()}"]
-                # Add change and change_percent to quote_data if possible
-                last_price = quote_data.get('last_price')
-                ohlc = quote_data.get('ohlc', {})
-                close = ohlc.get('close') if ohlc else quote_data.get('close')
-                if close is None:
-                    close = quote_data.get('close')
-                if last_price is not None and close not in (None, 0):
-                    change = last_price - close
-                    change_percent = ((last_price - close) / close) * 100 if close != 0 else 0
-                    quote_data['change'] = change
-                    quote_data['change_percent'] = change_percent
-        except Exception as e:
-            print(f"Error fetching quote for {symbol}: {e}")
+        quote_source = None
+        if not quote_job.ready():
+            quote_status = 'pending'
+        elif quote_job.successful():
+            quote_data, quote_source = quote_job.value
+            add_change_fields(quote_data)
+            quote_status = 'ok'
+        else:
+            print(f"Error fetching quote for {symbol}: {quote_job.exception}")
+            quote_status = 'error'
         
-        # Get historical data (last 30 days)
+        # A late history fetch keeps running and lands in the historical cache for the next request
         historical_data = None
-        try:
-            from datetime import timedelta
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=30)
-            
-            historical = kite.historical_data(
-                instrument_token=instrument['instrument_token'],
-                from_date=start_date.date(),
-                to_date=end_date.date(),
-                interval='day'
-            )
-            historical_data = historical
-        except Exception as e:
-            print(f"Error fetching historical data for {symbol}: {e}")
+        if not history_job.ready():
+            historical_status = 'pending'
+        elif history_job.successful():
+            historical_data = history_job.value
+            historical_status = 'fresh'
+        else:
+            print(f"Error fetching historical data for {symbol}: {history_job.exception}")
+            historical_status = 'error'
         
         # Convert timestamps to IST timezone
         ist_timezone = pytz.timezone('Asia/Kolkata')
         
-        # Convert historical data timestamps
-        if historical_data:
-            for candle in historical_data:
-                try:
-                    original_date = candle['date']
-                    
-                    if isinstance(original_date, str):
-                        # Handle string format like "Sun, 01 Jan 2023 18:30:00 GMT"
-                        if 'GMT' in original_date:
-                            gmt_dt = parsedate_to_datetime(original_date)
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                        else:
-                            # Handle ISO format
-                            gmt_dt = datetime.fromisoformat(original_date.replace('Z', '+00:00'))
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                    else:
-                        # Handle datetime object
-                        ist_dt = original_date.astimezone(ist_timezone)
-                    
-                    # Format with day name, date, time and timezone
-                    formatted_date = ist_dt.strftime('%A, %d %b %Y %H:%M:%S %Z')
-                    candle['date'] = formatted_date
-                    
-                except Exception as e:
-                    print(f"Error converting timezone for historical candle {candle}: {e}")
-                    continue
+        # Columnar candles keep epoch timestamps; row candles get formatted IST dates
+        if historical_data and columnar:
+            historical_data = candles_to_columns(historical_data)
+        elif historical_data:
+            format_candle_dates(historical_data)
         
         # Convert quote data timestamps if they exist
-        if quote_data:
-            # Convert timestamp field
-            if 'timestamp' in quote_data:
-                try:
-                    original_timestamp = quote_data['timestamp']
-                    if isinstance(original_timestamp, str):
-                        if 'GMT' in original_timestamp:
-                            gmt_dt = parsedate_to_datetime(original_timestamp)
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                        else:
-                            gmt_dt = datetime.fromisoformat(original_timestamp.replace('Z', '+00:00'))
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                    else:
-                        ist_dt = original_timestamp.astimezone(ist_timezone)
-                    
-                    quote_data['timestamp'] = ist_dt.strftime('%A, %d %b %Y %H:%M:%S %Z')
-                except Exception as e:
-                    print(f"Error converting quote timestamp: {e}")
-            
-            # Convert last_trade_time field
-            if 'last_trade_time' in quote_data:
-                try:
-                    original_trade_time = quote_data['last_trade_time']
-                    if isinstance(original_trade_time, str):
-                        if 'GMT' in original_trade_time:
-                            gmt_dt = parsedate_to_datetime(original_trade_time)
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                        else:
-                            gmt_dt = datetime.fromisoformat(original_trade_time.replace('Z', '+00:00'))
-                            ist_dt = gmt_dt.astimezone(ist_timezone)
-                    else:
-                        ist_dt = original_trade_time.astimezone(ist_timezone)
-                    
-                    quote_data['last_trade_time'] = ist_dt.strftime('%A, %d %b %Y %H:%M:%S %Z')
-                except Exception as e:
-                    print(f"Error converting last_trade_time: {e}")
+        format_quote_times(quote_data)
         
         # Compile detailed stock information
         stock_detail = {
@@ -328,92 +464,176 @@ def get_stock_detail(symbol):
             'tick_size': instrument['tick_size'],
             'lot_size': instrument['lot_size'],
             'quote': quote_data,
+            'quote_source': quote_source,
+            'quote_status': quote_status,
             'historical_data': historical_data,
+            'historical_format': 'columnar' if columnar else 'rows',
+            'historical_status': historical_status,
             'last_updated': datetime.now(ist_timezone).strftime('%A, %d %b %Y %H:%M:%S %Z'),
             'timezone': 'Asia/Kolkata (IST)'
         }
         
-        return jsonify(stock_detail)
+        return _payload_response(stock_detail, use_msgpack)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/stocks/batch_quotes', methods=['POST'])
 def get_batch_quotes():
-    """Get quote data for multiple stocks in a single request"""
+    """Get quote data for many stocks, merged or streamed as NDJSON per chunk.
+
+    Body: {"symbols": [...], "fields": [...]?, "mode": "ltp|ohlc|full"?, "stream": bool?}
+    The cheapest Kite mode that covers the requested fields is used unless
+    mode is given; streaming is also selected by Accept: application/x-ndjson.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         symbols = data.get('symbols', [])
+        fields = data.get('fields') or None
         
         if not symbols:
             return jsonify({"error": "Symbols list is required"}), 400
         
-        # Limit to 50 symbols to prevent abuse
-        if len(symbols) > 50:
-            symbols = symbols[:50]
+        if len(symbols) > BATCH_QUOTES_MAX_SYMBOLS:
+            return jsonify({"error": f"At most {BATCH_QUOTES_MAX_SYMBOLS} symbols per request"}), 400
         
-        quotes = {}
-        instruments = get_all_instruments()
+        mode = data.get('mode') or quote_mode_for_fields(fields)
+        if mode not in QUOTE_MODES:
+            return jsonify({"error": f"Invalid mode. Use one of: {', '.join(QUOTE_MODES)}"}), 400
         
-        # Prepare instrument tokens for batch quote
-        instrument_tokens = []
-        symbol_to_token = {}
+        stream = bool(data.get('stream')) or request.accept_mimetypes.best == 'application/x-ndjson'
         
-        for symbol in symbols:
-            symbol_upper = symbol.upper()
-            for inst in instruments:
-                if inst['tradingsymbol'] == symbol_upper:
-                    instrument_tokens.append(inst['instrument_token'])
-                    symbol_to_token[symbol_upper] = inst['instrument_token']
-                    break
+        # Resolve symbols to instruments; duplicates collapse onto one instrument
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        resolved = get_instrument_registry().resolve_many(symbols)
+        symbols_by_key = {}
+        for symbol, instrument in resolved.items():
+            symbols_by_key.setdefault(quote_key(instrument), []).append(symbol)
+        instruments = list({quote_key(inst): inst for inst in resolved.values()}.values())
         
-        if not instrument_tokens:
-            return jsonify({"quotes": {}})
+        def shape(batch_quotes):
+            quotes = {}
+            sources = {}
+            for key, (quote_data, source) in batch_quotes.items():
+                quote_data = project_quote(add_change_fields(quote_data), fields)
+                for symbol in symbols_by_key.get(key, ()):
+                    quotes[symbol] = quote_data
+                    sources[symbol] = source
+            return quotes, sources
         
-        try:
-            # Get batch quotes from Zerodha
-            batch_quotes = kite.quote([f"NSE:{symbol}" for symbol in symbols])
-            
-            # Process each quote
-            for symbol in symbols:
-                symbol_upper = symbol.upper()
-                quote_key = f"NSE:{symbol_upper}"
-                
-                if quote_key in batch_quotes:
-                    quote_data = batch_quotes[quote_key]
-                    
-                    # Calculate change and change_percent
-                    last_price = quote_data.get('last_price')
-                    ohlc = quote_data.get('ohlc', {})
-                    close = ohlc.get('close') if ohlc else quote_data.get('close')
-                    
-                    if close is None:
-                        close = quote_data.get('close')
-                    
-                    if last_price is not None and close not in (None, 0):
-                        change = last_price - close
-                        change_percent = ((last_price - close) / close) * 100 if close != 0 else 0
-                        quote_data['change'] = change
-                        quote_data['change_percent'] = change_percent
-                    
-                    quotes[symbol_upper] = quote_data
-                else:
-                    quotes[symbol_upper] = None
-                    
-        except Exception as e:
-            print(f"Error fetching batch quotes: {e}")
-            # Return empty quotes if batch fails
-            for symbol in symbols:
-                quotes[symbol.upper()] = None
+        # Chunks of 500 are fetched concurrently; ticks and cached quotes never reach Zerodha
+        chunks = quote_service.iter_quotes(instruments, mode, concurrency=BATCH_QUOTES_CONCURRENCY)
+        unresolved = [symbol for symbol in symbols if symbol not in resolved]
+        
+        if stream:
+            def generate():
+                if unresolved:
+                    yield app.json.dumps({"quotes": {s: None for s in unresolved},
+                                          "sources": {s: None for s in unresolved}}) + "\n"
+                for batch_quotes in chunks:
+                    quotes, sources = shape(batch_quotes)
+                    yield app.json.dumps({"quotes": quotes, "sources": sources}) + "\n"
+                yield app.json.dumps({"done": True, "mode": mode,
+                                      "timestamp": datetime.now().isoformat()}) + "\n"
+            return Response(generate(), mimetype='application/x-ndjson')
+        
+        quotes = {symbol: None for symbol in symbols}
+        sources = {symbol: None for symbol in symbols}
+        for batch_quotes in chunks:
+            chunk_quotes, chunk_sources = shape(batch_quotes)
+            quotes.update(chunk_quotes)
+            sources.update(chunk_sources)
         
         return jsonify({
             "quotes": quotes,
+            "sources": sources,
+            "mode": mode,
             "timestamp": datetime.now().isoformat()
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/option_chain/<underlying>', methods=['GET'])
+def get_option_chain(underlying):
+    """Get the option chain for an underlying with quotes for every strike"""
+    try:
+        exchange = request.args.get('exchange', 'NFO').upper()
+        expiry_str = request.args.get('expiry')
+        strike_min = request.args.get('strike_min', type=float)
+        strike_max = request.args.get('strike_max', type=float)
+        
+        try:
+            registry = get_instrument_registry(exchange)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        chains = registry.option_chains
+        if chains is None:
+            return jsonify({"error": f"No options listed on {exchange}"}), 400
+        
+        underlying = underlying.upper()
+        expiries = chains.expiry_dates(underlying)
+        if not expiries:
+            return jsonify({"error": f"No options found for '{underlying}' on {exchange}"}), 404
+        
+        # Default to the nearest expiry that has not passed yet
+        if expiry_str:
+            try:
+                expiry = datetime.strptime(expiry_str, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({"error": "Invalid expiry format. Use YYYY-MM-DD."}), 400
+            if expiry not in expiries:
+                return jsonify({
+                    "error": f"No {underlying} options expire on {expiry_str}",
+                    "expiries": [e.isoformat() for e in expiries]
+                }), 404
+        else:
+            expiry = chains.nearest_expiry(underlying, datetime.now().date()) or expiries[-1]
+        
+        chain = chains.chain(underlying, expiry, strike_min, strike_max)
+        
+        # Batch-fetch quotes for every leg; the coalescer splits them into 500-instrument calls
+        keys = [quote_key(inst) for row in chain for inst in (row['CE'], row['PE']) if inst]
+        quotes = {}
+        try:
+            quotes = quote_coalescer(keys)
+        except Exception as e:
+            print(f"Error fetching option chain quotes for {underlying}: {e}")
+        
+        def leg(inst):
+            if not inst:
+                return None
+            quote_data = quotes.get(quote_key(inst)) or {}
+            last_price = quote_data.get('last_price')
+            close = (quote_data.get('ohlc') or {}).get('close')
+            change = change_percent = None
+            if last_price is not None and close not in (None, 0):
+                change = last_price - close
+                change_percent = (change / close) * 100
+            return {
+                'symbol': inst['tradingsymbol'],
+                'instrument_token': inst['instrument_token'],
+                'lot_size': inst['lot_size'],
+                'last_price': last_price,
+                'change': change,
+                'change_percent': change_percent,
+                'volume': quote_data.get('volume'),
+                'oi': quote_data.get('oi')
+            }
+        
+        return jsonify({
+            'underlying': underlying,
+            'exchange': exchange,
+            'expiry': expiry.isoformat(),
+            'expiries': [e.isoformat() for e in expiries],
+            'strikes': [{'strike': row['strike'], 'CE': leg(row['CE']), 'PE': leg(row['PE'])} for row in chain],
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/market_status', methods=['GET'])
 def get_market_status():
     """Get current market status"""
@@ -422,7 +642,13 @@ def get_market_status():
             "status": "success",
             "timestamp": datetime.now().isoformat(),
             "active_symbols": len(latest_ticks),
+            "tick_subscriptions": tick_subscriptions.stats(),
             "total_symbols": len(get_all_instruments()),
+            "quotes": dict(quote_service.stats(),
+                           batching={mode: c.stats() for mode, c in quote_coalescers.items()}),
+            "kite_scheduler": kite_scheduler.stats(),
+            "candle_store": dict(candle_store.stats(), resampled=candle_levels.stats()),
+            "historical_cache": historical_cache.stats(),
             "market_open": True  # You can add logic to check if market is open
         })
     except Exception as e:
@@ -441,32 +667,89 @@ def search_stocks():
         if not query:
             return jsonify({"error": "Query parameter 'q' is required"}), 400
         
-        instruments = get_all_instruments()
-        query_upper = query.upper()
+        # Limit results to 20 by default, 100 at most
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        exchange = request.args.get('exchange', 'NSE').upper()
+        try:
+            registry = get_instrument_registry(exchange)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Search by symbol or name
+        # Ranked search by symbol or name via the prebuilt index
         results = []
-        for instrument in instruments:
-            if (query_upper in instrument['tradingsymbol'] or 
-                query_upper in instrument['name'].upper()):
-                stock_data = {
-                    'symbol': instrument['tradingsymbol'],
-                    'name': instrument['name'],
-                    'instrument_token': instrument['instrument_token'],
-                    'exchange': instrument['exchange'],
-                    'instrument_type': instrument['instrument_type']
-                }
-                results.append(stock_data)
-                
-                # Limit results to 20
-                if len(results) >= 20:
-                    break
+        for instrument in registry.search(query, limit=limit):
+            stock_data = {
+                'symbol': instrument['tradingsymbol'],
+                'name': instrument['name'],
+                'instrument_token': instrument['instrument_token'],
+                'exchange': instrument['exchange'],
+                'instrument_type': instrument['instrument_type']
+            }
+            results.append(stock_data)
         
         return jsonify({'results': results, 'query': query})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/instruments/dump', methods=['GET'])
+def dump_instruments():
+    """Stream the full instrument catalog as NDJSON (header line, then one instrument per line)"""
+    exchange = request.args.get('exchange', 'NSE').upper()
+    try:
+        registry = get_instrument_registry(exchange)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        yield app.json.dumps({
+            'exchange': exchange,
+            'version': registry.version,
+            'count': len(registry)
+        }) + '\n'
+        for instrument in registry.instruments:
+            yield app.json.dumps(instrument) + '\n'
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    if registry.version:
+        response.headers['X-Catalog-Version'] = registry.version
+    return response
+
+@app.route('/api/instruments/changes', methods=['GET'])
+def get_instrument_changes():
+    """Get instruments added, removed or modified since a catalog version"""
+    try:
+        exchange = request.args.get('exchange', 'NSE').upper()
+        since = request.args.get('since', '').strip()
+        if not since:
+            return jsonify({"error": "Query parameter 'since' is required"}), 400
+        
+        try:
+            catalog = instrument_catalogs.catalog(exchange)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        catalog.get()
+        
+        changes = catalog.changes_since(since)
+        if changes is None:
+            # Too old (or from another deploy): the client has to resync from the dump
+            return jsonify({
+                "error": f"Version '{since}' is no longer available, fetch /api/instruments/dump",
+                "version": catalog.registry.version
+            }), 410
+        
+        return jsonify({
+            'exchange': exchange,
+            'since': changes['from'],
+            'version': changes['to'],
+            'added': changes['added'],
+            'removed': changes['removed'],
+            'modified': changes['modified']
+        })
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/news', methods=['GET'])
 def get_news():
     """Get market news from multiple sources"""
@@ -587,83 +870,78 @@ def get_wishlist(user_id):
 def get_wishlist_details(user_id):
     """Get all wishlisted stocks for a user, including full stock details for each symbol."""
     try:
-        print(f"Fetching wishlist details for user: {user_id}")
         params = {'user_id': f'eq.{user_id}'}
         response = requests.get(SUPABASE_WISHLIST_ENDPOINT, headers=SUPABASE_HEADERS, params=params)
         if response.status_code != 200:
             print("Supabase error:", response.text)
             return jsonify({'error': response.text}), response.status_code
         wishlist = [item['symbol'] for item in response.json()]
-        print(f"Wishlist symbols: {wishlist}")
-        print(f"Wishlist length: {len(wishlist)}")
+        
+        registry = get_instrument_registry()
+        resolved = registry.resolve_many(wishlist)
+        instruments = []
+        not_found = []
+        for symbol in dict.fromkeys(s.upper() for s in wishlist):
+            if symbol in resolved:
+                instruments.append(resolved[symbol])
+            else:
+                not_found.append(symbol)
+        
+        # One batched quote call for the whole wishlist, run alongside the history fetches
+        quotes_job = gevent.spawn(quote_service.get_quotes, instruments)
+        
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=30)
+        
+        def fetch_history(instrument):
+            return load_candles(instrument['instrument_token'], 'day', start_date.date(), end_date.date())
+        
+        # Last 30 days of candles per symbol, concurrently; the scheduler keeps them under Kite's limit
+        pool = Pool(WISHLIST_HISTORY_CONCURRENCY)
+        history_jobs = [pool.spawn(fetch_history, instrument) for instrument in instruments]
+        gevent.joinall([quotes_job] + history_jobs)
+        
+        errors = {}
+        quotes = quotes_job.value or {}
+        if not quotes_job.successful():
+            print(f"Error fetching wishlist quotes for {user_id}: {quotes_job.exception}")
+        
         stock_details = []
-        for symbol in wishlist:
-            print(f"Processing symbol: {symbol}")
-            try:
-                instruments = get_all_instruments()
-                print(f"Number of instruments: {len(instruments)}")
-                instrument = None
-                for inst in instruments:
-                    if inst['tradingsymbol'] == symbol.upper():
-                        instrument = inst
-                        break
-                if not instrument:
-                    print(f"Instrument not found for symbol: {symbol}")
-                    continue
-                # Fetch quote data
-                quote_data = None
-                try:
-                    quote = kite.quote(f"NSE:{symbol.upper()}")
-                    if f"NSE:{symbol.upper()}" in quote:
-                        quote_data = quote[f"NSE:{symbol.upper()}"]
-                        last_price = quote_data.get('last_price')
-                        ohlc = quote_data.get('ohlc', {})
-                        close = ohlc.get('close') if ohlc else quote_data.get('close')
-                        if close is None:
-                            close = quote_data.get('close')
-                        if last_price is not None and close not in (None, 0):
-                            change = last_price - close
-                            change_percent = ((last_price - close) / close) * 100 if close != 0 else 0
-                            quote_data['change'] = change
-                            quote_data['change_percent'] = change_percent
-                except Exception as e:
-                    print(f"Error fetching quote for {symbol}: {e}")
-                # Fetch historical data (last 30 days)
-                historical_data = None
-                try:
-                    from datetime import timedelta
-                    end_date = datetime.now()
-                    start_date = end_date - timedelta(days=30)
-                    historical = kite.historical_data(
-                        instrument_token=instrument['instrument_token'],
-                        from_date=start_date.date(),
-                        to_date=end_date.date(),
-                        interval='day'
-                    )
-                    historical_data = historical
-                except Exception as e:
-                    print(f"Error fetching historical data for {symbol}: {e}")
-                stock_detail = {
-                    'symbol': instrument['tradingsymbol'],
-                    'name': instrument['name'],
-                    'instrument_token': instrument['instrument_token'],
-                    'exchange': instrument['exchange'],
-                    'instrument_type': instrument['instrument_type'],
-                    'segment': instrument['segment'],
-                    'expiry': instrument['expiry'],
-                    'strike': instrument['strike'],
-                    'tick_size': instrument['tick_size'],
-                    'lot_size': instrument['lot_size'],
-                    'quote': quote_data,
-                    'historical_data': historical_data,
-                    'last_updated': datetime.now().isoformat()
-                }
-                stock_details.append(stock_detail)
-            except Exception as e:
-                print(f"Error processing wishlist symbol {symbol}: {e}")
-                traceback.print_exc()
-                continue
-        return jsonify({'user_id': user_id, 'wishlist': wishlist, 'stock_details': stock_details}), 200
+        for instrument, history_job in zip(instruments, history_jobs):
+            symbol = instrument['tradingsymbol']
+            symbol_errors = {}
+            quote_data, quote_source = quotes.get(quote_key(instrument), (None, None))
+            if not quotes_job.successful():
+                symbol_errors['quote'] = str(quotes_job.exception)
+            if not history_job.successful():
+                print(f"Error fetching historical data for {symbol}: {history_job.exception}")
+                symbol_errors['historical_data'] = str(history_job.exception)
+            if symbol_errors:
+                errors[symbol] = symbol_errors
+            stock_details.append({
+                'symbol': symbol,
+                'name': instrument['name'],
+                'instrument_token': instrument['instrument_token'],
+                'exchange': instrument['exchange'],
+                'instrument_type': instrument['instrument_type'],
+                'segment': instrument['segment'],
+                'expiry': instrument['expiry'],
+                'strike': instrument['strike'],
+                'tick_size': instrument['tick_size'],
+                'lot_size': instrument['lot_size'],
+                'quote': add_change_fields(quote_data),
+                'quote_source': quote_source,
+                'historical_data': history_job.value,
+                'last_updated': datetime.now().isoformat()
+            })
+        
+        return jsonify({
+            'user_id': user_id,
+            'wishlist': wishlist,
+            'stock_details': stock_details,
+            'not_found': not_found,
+            'errors': errors
+        }), 200
     except Exception as e:
         print("Top-level error:", e)
         traceback.print_exc()
@@ -1004,170 +1282,127 @@ def get_combined_stock_events(symbol):
     except Exception as e:
         return jsonify({"error": "Failed to fetch stock events", "details": str(e)}), 500
 
-def fetch_daily_full(instrument_token, start_date, end_date):
+def fetch_range_full(instrument_token, interval, from_dt, to_dt):
     """
-    Fetch daily bars in 100-day chunks to ensure full coverage.
+    Fetch bars of any interval in the largest chunks Kite allows for it, concurrently, merged in time order.
     """
-    delta = timedelta(days=100)
-    current_start = start_date
-    all_bars = []
-    while current_start <= end_date:
-        current_end = min(current_start + delta, end_date)
-        try:
-            bars = kite.historical_data(
-                instrument_token=instrument_token,
-                from_date=current_start,
-                to_date=current_end,
-                interval='day'
-            ) or []
-        except Exception as e:
-            print(f"Error fetching {current_start} to {current_end}: {e}")
-            bars = []
-        all_bars.extend(bars)
-        current_start = current_end + timedelta(days=1)
-    # Deduplicate by date and sort
-    unique = {}
-    for bar in all_bars:
-        dt = bar['date'].date() if hasattr(bar['date'], 'date') \
-             else datetime.fromisoformat(str(bar['date']).replace('Z','+00:00')).date()
-        unique[dt] = bar
-    return [unique[dt] for dt in sorted(unique.keys())]
-
-def extract_last_trading_days(daily_candles, start_date, end_date):
+    chunks = plan_chunks(from_dt, to_dt, interval)
+    
+    def fetch_chunk(chunk_start, chunk_end):
+        return kite_historical_data(
+            instrument_token=instrument_token,
+            from_date=chunk_start,
+            to_date=chunk_end,
+            interval=interval
+        )
+    
+    return fetch_chunks(fetch_chunk, chunks, concurrency=HISTORICAL_CHUNK_CONCURRENCY)
+
+def fetch_daily_full(instrument_token, start_date, end_date):
     """
-    From a complete daily series, return one candle per calendar month,
-    selecting the last available trading day in each month.
+    Fetch daily bars for whole days in as few concurrent chunks as Kite allows.
     """
-    parsed = []
-    for candle in daily_candles:
-        if hasattr(candle['date'], 'date'):
-            dt = candle['date'].date()
-        else:
-            dt = datetime.fromisoformat(str(candle['date']).replace('Z','+00:00')).date()
-        if start_date <= dt <= end_date:
-            parsed.append((dt, candle))
-
-    parsed.sort(key=lambda x: x[0])
+    return fetch_range_full(
+        instrument_token, 'day',
+        datetime.combine(start_date, time.min), datetime.combine(end_date, time(23, 59, 59))
+    )
 
-    last_by_month = {}
-    for dt, candle in parsed:
-        key = (dt.year, dt.month)
-        last_by_month[key] = candle
+# Accepted ?frequency= values and the interval each one is served at
+HISTORICAL_FREQUENCIES = {
+    'day':'day','daily':'day',
+    'week':'week','weekly':'week',
+    'month':'month','monthly':'month',
+    'quarter':'quarter','quarterly':'quarter',
+    'year':'year','yearly':'year',
+    'minute':'minute','1minute':'minute',
+    '3minute':'3minute','5minute':'5minute','10minute':'10minute',
+    '15minute':'15minute','30minute':'30minute',
+    '60minute':'60minute','hour':'60minute'
+}
 
-    return [ last_by_month[ym] for ym in sorted(last_by_month.keys()) ]
-
-@app.route('/api/stocks/<symbol>/historical', methods=['GET'])
-def get_stock_historical_data(symbol):
-    """Get historical data for a specific stock with custom date range and frequency."""
-    # 1. Read & validate query parameters
-    start_date_str = request.args.get('start_date')
-    end_date_str   = request.args.get('end_date')
-    freq_input     = request.args.get('frequency', 'day').lower()
+def parse_historical_range(start_date_str, end_date_str, freq_input):
+    """Validate a historical request's range and frequency, returning (start_date, end_date, interval).
 
+    Raises ValueError with a client-facing message when the request is invalid.
+    """
     if not start_date_str or not end_date_str:
-        return jsonify({
-            "error": "start_date and end_date are required. Format: YYYY-MM-DD"
-        }), 400
+        raise ValueError("start_date and end_date are required. Format: YYYY-MM-DD")
 
-    freq_map = {
-        'day':'day','daily':'day',
-        'week':'week','weekly':'week',
-        'month':'day','monthly':'day'
-    }
-    if freq_input not in freq_map:
-        return jsonify({
-            "error": f"Invalid frequency. Must be one of: {', '.join(freq_map)}"
-        }), 400
+    if freq_input not in HISTORICAL_FREQUENCIES:
+        raise ValueError(f"Invalid frequency. Must be one of: {', '.join(HISTORICAL_FREQUENCIES)}")
 
-    # 2. Parse & sanity‐check dates
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         end_date   = datetime.strptime(end_date_str,   '%Y-%m-%d').date()
     except ValueError:
-        return jsonify({"error":"Invalid date format. Use YYYY-MM-DD."}), 400
+        raise ValueError("Invalid date format. Use YYYY-MM-DD.")
 
     if start_date > end_date:
-        return jsonify({"error":"start_date cannot be after end_date"}), 400
+        raise ValueError("start_date cannot be after end_date")
     if end_date > datetime.now().date():
-        return jsonify({"error":"end_date cannot be in the future"}), 400
+        raise ValueError("end_date cannot be in the future")
+
+    # Intraday ranges are capped; each one is still split into Kite-sized chunks when fetched
+    interval = HISTORICAL_FREQUENCIES[freq_input]
+    if interval in INTRADAY_INTERVALS and (end_date - start_date).days + 1 > HISTORICAL_INTRADAY_MAX_DAYS:
+        raise ValueError(f"Intraday ranges are limited to {HISTORICAL_INTRADAY_MAX_DAYS} days")
+
+    return start_date, end_date, interval
+
+def load_candles(instrument_token, interval, start_date, end_date):
+    """Candles for any supported interval over whole days, through the historical result cache"""
+    # A week/month/quarter/year bar runs to the end of its period, so it stays live while that includes today
+    data_end = period_end(end_date, interval) if interval in PERIODS else end_date
+    return historical_cache.get_or_load(
+        (instrument_token, interval, start_date, end_date), data_end,
+        lambda: _load_candles(instrument_token, interval, start_date, end_date)
+    )
+
+def _load_candles(instrument_token, interval, start_date, end_date):
+    if interval == 'day':
+        return load_daily_candles(instrument_token, start_date, end_date)
+    if interval in INTRADAY_INTERVALS:
+        # Closed sessions come from the candle store; only gaps and today's session hit Kite
+        return candle_store.get(instrument_token, interval, start_date, end_date)
+    # Coarser bars come from the instrument's precomputed levels, built from daily candles
+    return candle_levels.get(instrument_token, interval, start_date, end_date)
+
+@app.route('/api/stocks/<symbol>/historical', methods=['GET'])
+def get_stock_historical_data(symbol):
+    """Get historical data for a specific stock with custom date range and frequency."""
+    # 1. Read & validate query parameters
+    start_date_str = request.args.get('start_date')
+    end_date_str   = request.args.get('end_date')
+    freq_input     = request.args.get('frequency', 'day').lower()
+    columnar, use_msgpack = _historical_options()
+    if use_msgpack and not msgpack_available():
+        return jsonify({"error": "msgpack encoding is not available"}), 406
+
+    # 2. Parse & sanity-check dates and frequency
+    try:
+        start_date, end_date, interval = parse_historical_range(start_date_str, end_date_str, freq_input)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # 3. Lookup instrument_token
-    instruments = get_all_instruments()
-    instrument = next((i for i in instruments if i['tradingsymbol'] == symbol.upper()), None)
+    instrument = get_instrument_registry().get_by_symbol(symbol)
     if not instrument:
         return jsonify({"error": f"Stock '{symbol}' not found"}), 404
 
     # 4. Fetch & filter data
-    interval = freq_map[freq_input]
     try:
-        if freq_input in ('month','monthly'):
-            # Fetch full daily series then extract last trading-day of each month
-            raw_daily = fetch_daily_full(
-                instrument['instrument_token'],
-                start_date, end_date
-            )
-            data = extract_last_trading_days(raw_daily, start_date, end_date)
-        else:
-            # daily/weekly: fetch directly at requested interval
-            raw = kite.historical_data(
-                instrument_token=instrument['instrument_token'],
-                from_date=start_date,
-                to_date=end_date,
-                interval=interval
-            ) or []
-            data = []
-            for candle in raw:
-                try:
-                    if hasattr(candle['date'], 'date'):
-                        dt = candle['date'].date()
-                    else:
-                        date_str = str(candle['date'])
-                        if 'GMT' in date_str:
-                            dt = parsedate_to_datetime(date_str).date()
-                        else:
-                            dt = datetime.fromisoformat(date_str.replace('Z', '+00:00')).date()
-                    if start_date <= dt <= end_date:
-                        data.append(candle)
-                except Exception as e:
-                    print(f"Error processing candle: {e}")
-                    continue
+        data = load_candles(instrument['instrument_token'], interval, start_date, end_date)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error":f"Failed to fetch data: {e}"}), 500
 
-    # 5. Convert timestamps to local timezone (IST) with day name
+    # 5. Convert timestamps to local timezone (IST) with day name, or to epoch columns
     ist_timezone = pytz.timezone('Asia/Kolkata')
-    
-    for candle in data:
-        try:
-            # Parse the original date
-            original_date = candle['date']
-            
-            if isinstance(original_date, str):
-                # Handle string format like "Sun, 01 Jan 2023 18:30:00 GMT"
-                if 'GMT' in original_date:
-                    # Parse GMT date and convert to IST
-                    gmt_dt = parsedate_to_datetime(original_date)
-                    ist_dt = gmt_dt.astimezone(ist_timezone)
-                else:
-                    # Handle ISO format
-                    gmt_dt = datetime.fromisoformat(original_date.replace('Z', '+00:00'))
-                    ist_dt = gmt_dt.astimezone(ist_timezone)
-            else:
-                # Handle datetime object
-                ist_dt = original_date.astimezone(ist_timezone)
-            
-            # Format with day name, date, time and timezone
-            # Format: "Monday, 02 Jan 2023 00:00:00 IST"
-            formatted_date = ist_dt.strftime('%A, %d %b %Y %H:%M:%S %Z')
-            
-            # Update the date field with IST timestamp including day name
-            candle['date'] = formatted_date
-            
-        except Exception as e:
-            print(f"Error converting timezone for candle {candle}: {e}")
-            # Keep original if conversion fails
-            continue
+    data_points = len(data)
+    if columnar:
+        data = candles_to_columns(data)
+    else:
+        format_candle_dates(data)
 
     # 6. Build & return response
     resp = {
@@ -1178,17 +1413,19 @@ def get_stock_historical_data(symbol):
         'end_date': end_date_str,
         'frequency': freq_input,
         'interval': interval,
-        'data_points': len(data),
+        'data_points': data_points,
         'historical_data': data,
+        'historical_format': 'columnar' if columnar else 'rows',
         'last_updated': datetime.now(ist_timezone).strftime('%A, %d %b %Y %H:%M:%S %Z'),
         'timezone': 'Asia/Kolkata (IST)'
     }
 
-    if freq_input in ('month','monthly'):
-        resp['note'] = ('Monthly data shows the last trading-day of each month '
-                        '(or previous trading-day if month-end was a holiday/weekend).')
+    if interval in PERIODS:
+        resp['note'] = (f'Each {interval} bar aggregates its daily candles (first open, highest high, '
+                        'lowest low, last close, total volume) and is dated by its first trading day. '
+                        f'Bars cover every {interval} that overlaps the requested range.')
 
-    if not data:
+    if not data_points:
         resp['debug_info'] = {
             'message': 'No data available for the specified range.',
             'suggestions': [
@@ -1199,7 +1436,71 @@ def get_stock_historical_data(symbol):
             ]
         }
 
-    return jsonify(resp)
+    return _payload_response(resp, use_msgpack)
+
+@app.route('/api/stocks/historical/bulk', methods=['POST'])
+def get_bulk_historical_data():
+    """Stream historical data for many stocks as NDJSON, one line per symbol as each is ready.
+
+    Body: {"symbols": [...], "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD",
+           "frequency": "day"?, "format": "rows|columnar"?}
+    """
+    data = request.get_json() or {}
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in data.get('symbols', [])))
+    freq_input = str(data.get('frequency', 'day')).lower()
+    columnar = str(data.get('format', 'rows')).lower() == 'columnar'
+
+    if not symbols:
+        return jsonify({"error": "Symbols list is required"}), 400
+    if len(symbols) > BULK_HISTORICAL_MAX_SYMBOLS:
+        return jsonify({"error": f"At most {BULK_HISTORICAL_MAX_SYMBOLS} symbols per request"}), 400
+
+    try:
+        start_date, end_date, interval = parse_historical_range(
+            data.get('start_date'), data.get('end_date'), freq_input
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    resolved = get_instrument_registry().resolve_many(symbols)
+
+    def fetch_symbol(symbol):
+        instrument = resolved.get(symbol)
+        if instrument is None:
+            return {'symbol': symbol, 'error': f"Stock '{symbol}' not found"}
+        try:
+            candles = load_candles(instrument['instrument_token'], interval, start_date, end_date)
+        except Exception as e:
+            print(f"Error fetching bulk historical data for {symbol}: {e}")
+            return {'symbol': symbol, 'error': f"Failed to fetch data: {e}"}
+        return {
+            'symbol': symbol,
+            'instrument_token': instrument['instrument_token'],
+            'interval': interval,
+            'data_points': len(candles),
+            'historical_data': candles_to_columns(candles) if columnar else format_candle_dates(candles),
+        }
+
+    def generate():
+        # Fetches run together on the pool and are paced by the Kite scheduler;
+        # each line is encoded and released as soon as its symbol completes.
+        # maxsize stops fetching when a slow client leaves finished symbols unread.
+        failed = 0
+        pool = Pool(BULK_HISTORICAL_CONCURRENCY)
+        for line in pool.imap_unordered(fetch_symbol, symbols, maxsize=BULK_HISTORICAL_CONCURRENCY):
+            failed += 'error' in line
+            yield app.json.dumps(line) + "\n"
+        yield app.json.dumps({
+            'done': True,
+            'symbols': len(symbols),
+            'failed': failed,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'interval': interval,
+            'historical_format': 'columnar' if columnar else 'rows',
+        }) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 def _is_audio(filename: str, content_type: str) -> bool:
     """Check if the uploaded file is a valid audio file based on filename and content type."""
@@ -1270,20 +1571,16 @@ def answer_audio():
             
 def on_ticks(ws, ticks):
     """Callback when ticks are received"""
+    registry = get_instrument_registry()
     for tick in ticks:
         instrument_token = tick["instrument_token"]
         
         # Get instrument details for symbol
-        symbol = None
-        tradingsymbol = None
-        for instrument in get_all_instruments():
-            if instrument['instrument_token'] == instrument_token:
-                symbol = instrument['tradingsymbol']
-                tradingsymbol = instrument['tradingsymbol']
-                break
-        
-        # Store tick data with symbol information
-        latest_ticks[instrument_token] = {
+        symbol = registry.symbol_for_token(instrument_token)
+        tradingsymbol = symbol
+        
+        # Store tick data with symbol information; unchanged instruments are not re-broadcast
+        latest_ticks.update(instrument_token, {
             "instrument_token": instrument_token,
             "symbol": symbol,
             "tradingsymbol": tradingsymbol,
@@ -1296,7 +1593,7 @@ def on_ticks(ws, ticks):
             "open": tick.get("open", 0),
             "close": tick.get("close", 0),
             "timestamp": datetime.now().isoformat()
-        }
+        }, raw=tick)
     print(f"Received ticks for {len(ticks)} instruments")
 
 def on_connect(ws, response):
@@ -1310,8 +1607,8 @@ def on_connect(ws, response):
         "TATAMOTORS", "SUNPHARMA", "POWERGRID", "TECHM", "NTPC",
         "ADANIENT", "ADANIPORTS", "BAJAJFINSV", "BAJAJ-AUTO", "COALINDIA"
     ]
-    instruments = get_all_instruments()
-    instrument_tokens = [inst['instrument_token'] for inst in instruments if inst['tradingsymbol'] in popular_symbols]
+    registry = get_instrument_registry()
+    instrument_tokens = [inst['instrument_token'] for inst in registry.resolve_many(popular_symbols).values()]
 
     ws.subscribe(instrument_tokens)
     ws.set_mode(ws.MODE_FULL, instrument_tokens)
@@ -1344,13 +1641,36 @@ def start_kite_ws():
             import time
             time.sleep(5)
 
+def _tick_message(kind, seq, ticks_list):
+    return {'type': kind, 'seq': seq, 'data': ticks_list, 'timestamp': datetime.now().isoformat()}
+
+def tick_room(instrument_token):
+    return f"tick:{instrument_token}"
+
+def _emit_ticks(kind, seq, ticks_list):
+    """Send each tick to its instrument's room, and the whole batch to clients watching everything"""
+    if tick_subscriptions.all_sids:
+        socketio.emit('tick_data', _tick_message(kind, seq, ticks_list), to=ALL_TICKS_ROOM)
+    for tick in ticks_list:
+        if tick_subscriptions.has_subscribers(tick['instrument_token']):
+            socketio.emit('tick_data', _tick_message(kind, seq, [tick]), to=tick_room(tick['instrument_token']))
+
 def background_tick_sender():
+    """Broadcast only the instruments that changed, with a periodic full snapshot to resync clients"""
     import time
+    last_snapshot = time.monotonic()
     while True:
-        if latest_ticks:
-            ticks_list = list(latest_ticks.values())
-            socketio.emit('tick_data', {'data': ticks_list, 'timestamp': datetime.now().isoformat()})
-        time.sleep(0.1)
+        if time.monotonic() - last_snapshot >= TICK_SNAPSHOT_INTERVAL:
+            last_snapshot = time.monotonic()
+            if len(latest_ticks):
+                seq, ticks_list = latest_ticks.take_snapshot()
+                _emit_ticks('snapshot', seq, ticks_list)
+        else:
+            delta = latest_ticks.take_delta()
+            if delta:
+                seq, ticks_list = delta
+                _emit_ticks('delta', seq, ticks_list)
+        time.sleep(TICK_EMIT_INTERVAL)
         
 
 @socketio.on('connect')
@@ -1360,6 +1680,68 @@ def handle_connect():
         "timestamp": datetime.now().isoformat(),
         "total_instruments": len(get_all_instruments())
     })
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    tick_subscriptions.drop(request.sid)
+
+def _subscription_request(data):
+    """Validate a subscribe/unsubscribe payload, returning (tokens, unknown symbols, all)"""
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError('Payload must be an object like {"symbols": [...]}')
+    symbols = data.get('symbols', [])
+    raw_tokens = data.get('tokens', [])
+    if not isinstance(symbols, list) or not isinstance(raw_tokens, list):
+        raise ValueError("'symbols' and 'tokens' must be lists")
+    symbols = [str(symbol).upper() for symbol in symbols]
+    resolved = get_instrument_registry().resolve_many(symbols) if symbols else {}
+    tokens = [inst['instrument_token'] for inst in resolved.values()]
+    tokens.extend(int(token) for token in raw_tokens)
+    unknown = [symbol for symbol in symbols if symbol not in resolved]
+    return list(dict.fromkeys(tokens)), unknown, bool(data.get('all'))
+
+@socketio.on('subscribe')
+def handle_subscribe(data=None):
+    """Join per-instrument tick rooms: {"symbols": [...], "tokens": [...]} or {"all": true}"""
+    try:
+        tokens, unknown, watch_all = _subscription_request(data)
+    except (TypeError, ValueError) as e:
+        emit('subscription_error', {'error': str(e)})
+        return
+    if watch_all:
+        join_room(ALL_TICKS_ROOM)
+        tick_subscriptions.subscribe_all(request.sid)
+    for token in tokens:
+        join_room(tick_room(token))
+    tick_subscriptions.subscribe(request.sid, tokens)
+    emit('subscribed', {'tokens': tokens, 'unknown_symbols': unknown, 'all': watch_all})
+
+    # Start the client from a snapshot of what it asked for; later deltas carry higher seq numbers
+    seq, ticks_list = latest_ticks.snapshot()
+    if not watch_all:
+        wanted = set(tokens)
+        ticks_list = [tick for tick in ticks_list if tick['instrument_token'] in wanted]
+    if ticks_list:
+        emit('tick_data', _tick_message('snapshot', seq, ticks_list))
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data=None):
+    """Leave per-instrument tick rooms, or the all-instruments room with {"all": true}"""
+    try:
+        tokens, unknown, watch_all = _subscription_request(data)
+    except (TypeError, ValueError) as e:
+        emit('subscription_error', {'error': str(e)})
+        return
+    if watch_all:
+        leave_room(ALL_TICKS_ROOM)
+        tick_subscriptions.unsubscribe_all(request.sid)
+    for token in tokens:
+        leave_room(tick_room(token))
+    tick_subscriptions.unsubscribe(request.sid, tokens)
+    emit('unsubscribed', {'tokens': tokens, 'unknown_symbols': unknown, 'all': watch_all})
+
 HEARTBEAT_INTERVAL = 20  # seconds
 
 def background_heartbeat():
@@ -1371,6 +1753,11 @@ def background_heartbeat():
 def on_client_ping():
     emit('pong_from_server', {'message': 'pong', 'timestamp': datetime.now().isoformat()})
     
+# Serve the persisted catalog immediately and refresh it from Kite in the background
+nse_catalog = instrument_catalogs.catalog('NSE')
+if nse_catalog.expired():
+    nse_catalog.refresh_async()
+
 if __name__ == "__main__":
     print("Starting Zerodha WebSocket streamer...")
     # Start background tasks using SocketIO's method
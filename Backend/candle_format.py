@@ -0,0 +1,87 @@
+"""Compact encodings for candle series sent to clients."""
+from datetime import date, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List
+
+import numpy as np
+
+from market_time import IST_OFFSET_SECONDS
+
+try:
+    import msgpack
+except ImportError:  # msgpack responses are optional
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Short column names and the candle fields they carry
+COLUMNS = (('o', 'open'), ('h', 'high'), ('l', 'low'), ('c', 'close'), ('v', 'volume'))
+
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+
+
+def candle_epoch(when: Any) -> int:
+    if isinstance(when, datetime):
+        return int(when.timestamp())
+    if isinstance(when, str):
+        if 'GMT' in when:
+            when = parsedate_to_datetime(when)
+        else:
+            when = datetime.fromisoformat(when.replace('Z', '+00:00'))
+    return int(when.timestamp())
+
+
+def candle_epochs(candles: List[Dict]) -> np.ndarray:
+    """Epoch seconds of every candle's date; the only step that touches each candle's datetime"""
+    return np.fromiter((candle_epoch(candle['date']) for candle in candles), dtype=np.int64, count=len(candles))
+
+
+def ist_date_labels(epochs: np.ndarray) -> List[str]:
+    """'Monday, 02 Jan 2023 09:15:00 IST' for each epoch second.
+
+    The series is split into IST days and seconds-of-day as arrays, and only
+    the distinct days (one per session) and times (at most 375 per session
+    for minute candles) are formatted; each label is then joined by index.
+    """
+    days, seconds = np.divmod(epochs + IST_OFFSET_SECONDS, SECONDS_PER_DAY)
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    unique_seconds, second_index = np.unique(seconds, return_inverse=True)
+    day_labels = [(EPOCH + timedelta(days=day)).strftime('%A, %d %b %Y ') for day in unique_days.tolist()]
+    time_labels = [f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d} IST"
+                   for second in unique_seconds.tolist()]
+    return [day_labels[d] + time_labels[t] for d, t in zip(day_index.tolist(), second_index.tolist())]
+
+
+def format_candle_dates(candles: List[Dict]) -> List[Dict]:
+    """Replace every candle's date with its IST label in place"""
+    for candle, label in zip(candles, ist_date_labels(candle_epochs(candles))):
+        candle['date'] = label
+    return candles
+
+
+def candles_to_columns(candles: List[Dict]) -> Dict[str, List]:
+    """Parallel t/o/h/l/c/v arrays (t in epoch seconds), plus oi when the candles carry it"""
+    columns = {'t': candle_epochs(candles).tolist()}
+    for short, field in COLUMNS:
+        columns[short] = [candle.get(field) for candle in candles]
+    if candles and 'oi' in candles[0]:
+        columns['oi'] = [candle.get('oi') for candle in candles]
+    return columns
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot msgpack-encode {type(value).__name__}")
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def packb(payload: Any) -> bytes:
+    """msgpack-encode a response payload, writing dates as ISO strings"""
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
@@ -0,0 +1,210 @@
+"""Local SQLite store of Kite historical candles with gap-aware refills."""
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple, Union
+
+from gevent.lock import RLock
+
+from market_time import IST
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL,
+    volume INTEGER,
+    oi INTEGER,
+    PRIMARY KEY (token, interval, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (token, interval, start)
+) WITHOUT ROWID;
+"""
+
+
+def ist_midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=IST)
+
+
+def range_bounds(start: Union[date, datetime], end: Union[date, datetime]) -> Tuple[int, int]:
+    """Epoch-second [start, end) for a request; plain dates cover whole IST days, end inclusive"""
+    if isinstance(start, datetime):
+        start_ts = int((start if start.tzinfo else start.replace(tzinfo=IST)).timestamp())
+    else:
+        start_ts = int(ist_midnight(start).timestamp())
+    if isinstance(end, datetime):
+        end_ts = int((end if end.tzinfo else end.replace(tzinfo=IST)).timestamp()) + 1
+    else:
+        end_ts = int(ist_midnight(end + timedelta(days=1)).timestamp())
+    return start_ts, end_ts
+
+
+def subtract_ranges(start: int, end: int, covered: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Parts of [start, end) not inside any of the sorted covered ranges"""
+    gaps = []
+    cursor = start
+    for lo, hi in covered:
+        if hi <= cursor:
+            continue
+        if lo >= end:
+            break
+        if lo > cursor:
+            gaps.append((cursor, lo))
+        cursor = max(cursor, hi)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class CandleStore:
+    """Candles keyed by (instrument_token, interval), filled from Kite only where missing.
+
+    A coverage table records which time ranges have been fetched completely.
+    Ranges before today's IST session are closed and never fetched again;
+    today's is always re-read from Kite and upserted over the stored rows.
+
+    fetch(token, interval, from_dt, to_dt) returns kite.historical_data
+    style candles for the inclusive naive-IST datetime range, and must raise
+    rather than return a partial result.
+
+    Under gevent a blocked SQLite call stalls every greenlet, so once open
+    the store waits at most busy_timeout seconds for another worker's write
+    lock; if the database stays locked the range is served straight from
+    Kite. Opening it waits up to setup_timeout, since workers booting
+    together race to create the schema and have nothing to fall back on.
+    """
+
+    def __init__(self, path: str, fetch: Callable[[int, str, datetime, datetime], List[Dict]],
+                 busy_timeout: float = 0.05, setup_timeout: float = 30):
+        self.path = path
+        self.fetch = fetch
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=setup_timeout, check_same_thread=False, isolation_level=None)
+        self._setup(setup_timeout)
+        self.db.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+        self._locks: Dict[Tuple[int, str], RLock] = defaultdict(RLock)
+        self.local_reads = 0
+        self.fetched_segments = 0
+        self.bypassed = 0
+
+    def _setup(self, timeout: float):
+        # Switching to WAL reports "locked" without waiting on the busy timeout, so retry until the deadline
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute('PRAGMA synchronous=NORMAL')
+                self.db.executescript(SCHEMA)
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _covered(self, token: int, interval: str, start: int, end: int) -> List[Tuple[int, int]]:
+        return self.db.execute(
+            'SELECT start, end FROM coverage WHERE token=? AND interval=? AND end>? AND start<? ORDER BY start',
+            (token, interval, start, end)
+        ).fetchall()
+
+    def missing(self, token: int, interval: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """Epoch-second ranges of [start, end) that must still come from Kite"""
+        open_from = int(ist_midnight(datetime.now(IST).date()).timestamp())
+        gaps = subtract_ranges(start, min(end, open_from), self._covered(token, interval, start, end))
+        if end > open_from:
+            gaps.append((max(start, open_from), end))
+        return gaps
+
+    def _mark_covered(self, token: int, interval: str, start: int, end: int):
+        # Merge with every overlapping or touching range into a single row
+        rows = self.db.execute(
+            'SELECT start, end FROM coverage WHERE token=? AND interval=? AND end>=? AND start<=?',
+            (token, interval, start, end)
+        ).fetchall()
+        for lo, hi in rows:
+            start, end = min(start, lo), max(end, hi)
+        self.db.execute('DELETE FROM coverage WHERE token=? AND interval=? AND end>=? AND start<=?',
+                        (token, interval, start, end))
+        self.db.execute('INSERT INTO coverage (token, interval, start, end) VALUES (?, ?, ?, ?)',
+                        (token, interval, start, end))
+
+    def _store(self, token: int, interval: str, candles: List[Dict]):
+        rows = []
+        for candle in candles:
+            when = candle['date']
+            if isinstance(when, str):
+                when = datetime.fromisoformat(when.replace('Z', '+00:00'))
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=IST)
+            rows.append((token, interval, int(when.timestamp()), candle['open'], candle['high'],
+                         candle['low'], candle['close'], candle.get('volume'), candle.get('oi')))
+        self.db.executemany('INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _fill(self, token: int, interval: str, start: int, end: int):
+        open_from = int(ist_midnight(datetime.now(IST).date()).timestamp())
+        for lo, hi in self.missing(token, interval, start, end):
+            from_dt = datetime.fromtimestamp(lo, IST).replace(tzinfo=None)
+            to_dt = datetime.fromtimestamp(hi - 1, IST).replace(tzinfo=None)
+            candles = self.fetch(token, interval, from_dt, to_dt) or []
+            self.fetched_segments += 1
+            self.db.execute('BEGIN')
+            try:
+                self._store(token, interval, candles)
+                if lo < open_from:
+                    self._mark_covered(token, interval, lo, min(hi, open_from))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def read(self, token: int, interval: str, start: int, end: int) -> List[Dict]:
+        """Stored candles in [start, end), shaped like kite.historical_data results"""
+        rows = self.db.execute(
+            'SELECT ts, open, high, low, close, volume, oi FROM candles '
+            'WHERE token=? AND interval=? AND ts>=? AND ts<? ORDER BY ts',
+            (token, interval, start, end)
+        ).fetchall()
+        candles = []
+        for ts, open_, high, low, close, volume, oi in rows:
+            candle = {'date': datetime.fromtimestamp(ts, IST), 'open': open_, 'high': high,
+                      'low': low, 'close': close, 'volume': volume}
+            if oi is not None:
+                candle['oi'] = oi
+            candles.append(candle)
+        return candles
+
+    def get(self, token: int, interval: str, start: Union[date, datetime],
+            end: Union[date, datetime]) -> List[Dict]:
+        """Candles for a range, fetching only the gaps and the open session from Kite"""
+        start_ts, end_ts = range_bounds(start, end)
+        try:
+            with self._locks[(token, interval)]:
+                self._fill(token, interval, start_ts, end_ts)
+            candles = self.read(token, interval, start_ts, end_ts)
+        except sqlite3.OperationalError as e:
+            print(f"Candle store unavailable ({e}), serving {token} {interval} from Kite")
+            self.bypassed += 1
+            return self.fetch(token, interval, datetime.fromtimestamp(start_ts, IST).replace(tzinfo=None),
+                              datetime.fromtimestamp(end_ts - 1, IST).replace(tzinfo=None)) or []
+        self.local_reads += 1
+        return candles
+
+    def stats(self) -> Dict:
+        return {
+            'path': self.path,
+            'reads': self.local_reads,
+            'fetched_segments': self.fetched_segments,
+            'bypassed': self.bypassed,
+        }
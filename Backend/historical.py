@@ -0,0 +1,77 @@
+"""Planning and concurrent fetching of Kite historical candle ranges."""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import gevent
+from gevent.pool import Pool
+
+# Longest range Kite serves in one historical_data call, per interval
+KITE_MAX_RANGE_DAYS = {
+    'minute': 60,
+    '3minute': 100,
+    '5minute': 100,
+    '10minute': 100,
+    '15minute': 200,
+    '30minute': 200,
+    '60minute': 400,
+    'day': 2000,
+}
+
+INTRADAY_INTERVALS = tuple(interval for interval in KITE_MAX_RANGE_DAYS if interval != 'day')
+
+
+def plan_chunks(from_dt: datetime, to_dt: datetime, interval: str) -> List[Tuple[datetime, datetime]]:
+    """Split an inclusive range into consecutive chunks no longer than Kite allows for the interval"""
+    span = timedelta(days=KITE_MAX_RANGE_DAYS[interval])
+    chunks = []
+    start = from_dt
+    while start <= to_dt:
+        end = min(start + span - timedelta(seconds=1), to_dt)
+        chunks.append((start, end))
+        start = end + timedelta(seconds=1)
+    return chunks
+
+
+def candle_time(candle: Dict) -> datetime:
+    when = candle['date']
+    if isinstance(when, datetime):
+        return when
+    return datetime.fromisoformat(str(when).replace('Z', '+00:00'))
+
+
+def fetch_chunks(fetch: Callable[[datetime, datetime], List[Dict]], chunks: List[Tuple[datetime, datetime]],
+                 concurrency: int = 3, retries: int = 2, retry_delay: float = 0.5) -> List[Dict]:
+    """Fetch planned chunks concurrently and merge them in time order without duplicates.
+
+    Each chunk is retried up to retries times with a growing delay; if one
+    still fails the error propagates, so callers never see a silent hole.
+    """
+    def fetch_chunk(chunk):
+        attempt = 0
+        while True:
+            try:
+                return fetch(*chunk) or []
+            except Exception as e:
+                if attempt >= retries:
+                    print(f"Error fetching {chunk[0]} to {chunk[1]}: {e}")
+                    raise
+                attempt += 1
+                gevent.sleep(retry_delay * attempt)
+
+    if len(chunks) == 1:
+        results = [fetch_chunk(chunks[0])]
+    else:
+        pool = Pool(concurrency)
+        jobs = [pool.spawn(fetch_chunk, chunk) for chunk in chunks]
+        try:
+            gevent.joinall(jobs, raise_error=True)
+        finally:
+            pool.kill()
+        results = [job.value for job in jobs]
+
+    # Chunks are merged in plan order; a candle on a chunk boundary is kept once
+    unique = {}
+    for candles in results:
+        for candle in candles:
+            unique[candle_time(candle)] = candle
+    return [unique[when] for when in sorted(unique)]
@@ -0,0 +1,344 @@
+"""Loading, caching and on-disk snapshots of the Kite instrument catalogs.
+
+The snapshot is a single binary file: a small JSON header followed by
+8-byte aligned column blocks (int64/float64 arrays, ordinal-encoded
+expiry dates and dictionary-encoded strings). Columns sit at fixed
+offsets so the file can be memory-mapped and decoded without parsing
+the Kite CSV again.
+
+InstrumentCatalog keeps one exchange's catalog fresh in the background and
+ExchangeCatalogs loads each supported exchange lazily on first use.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gevent
+
+from instruments import COLUMN_TYPECODES, INSTRUMENT_COLUMNS, InstrumentColumns, InstrumentRegistry
+
+SNAPSHOT_MAGIC = b'ZINST\x00'
+SNAPSHOT_FORMAT = 1
+_PREAMBLE = struct.Struct('<HI')  # format, header length
+
+# Exchanges kite.instruments() can list; each one is loaded on first use
+SUPPORTED_EXCHANGES = ('NSE', 'BSE', 'NFO', 'CDS', 'MCX')
+
+# Catalog diffs kept per exchange for incremental client sync
+CHANGE_HISTORY_SIZE = 30
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _pad(block: bytes) -> bytes:
+    return block + b'\x00' * (_align(len(block)) - len(block))
+
+
+def encode_snapshot(instruments: InstrumentColumns, fetched_at: float, exchange: str = 'NSE') -> Tuple[bytes, str]:
+    """Serialize a catalog to snapshot bytes, returning (payload, version).
+
+    The version is a checksum of the column data, so identical catalogs get
+    identical versions regardless of which worker fetched them.
+    """
+    blocks = []
+    columns = []
+    offset = 0
+    checksum = 0
+    for name, kind in INSTRUMENT_COLUMNS:
+        values = instruments.columns[name].tobytes()
+        column = {'name': name, 'kind': kind, 'offset': offset, 'length': len(values)}
+        blocks.append(_pad(values))
+        offset += _align(len(values))
+        checksum = zlib.crc32(values, checksum)
+        if kind == 'str':
+            strings = instruments.tables[name]
+            table = '\x00'.join(strings).encode('utf-8')
+            column.update(table_offset=offset, table_length=len(table), table_size=len(strings))
+            blocks.append(_pad(table))
+            offset += _align(len(table))
+            checksum = zlib.crc32(table, checksum)
+        columns.append(column)
+
+    version = f"{checksum:08x}-{len(instruments)}"
+    header = json.dumps({
+        'version': version,
+        'fetched_at': fetched_at,
+        'exchange': exchange,
+        'count': len(instruments),
+        'byteorder': sys.byteorder,
+        'columns': columns,
+    }, separators=(',', ':')).encode('utf-8')
+
+    prefix = SNAPSHOT_MAGIC + _PREAMBLE.pack(SNAPSHOT_FORMAT, len(header)) + header
+    return _pad(prefix) + b''.join(blocks), version
+
+
+def decode_snapshot(buf) -> Tuple[InstrumentColumns, Dict]:
+    """Decode snapshot bytes (or an mmap) straight into columns, returning (instruments, header)"""
+    view = memoryview(buf)
+    try:
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError("Not an instrument snapshot")
+        pos = len(SNAPSHOT_MAGIC)
+        fmt, header_len = _PREAMBLE.unpack(view[pos:pos + _PREAMBLE.size])
+        if fmt != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {fmt}")
+        pos += _PREAMBLE.size
+        header = json.loads(bytes(view[pos:pos + header_len]).decode('utf-8'))
+
+        swap = header['byteorder'] != sys.byteorder
+        columns = {}
+        tables = {}
+        with view[_align(pos + header_len):] as data:
+            for column in header['columns']:
+                values = array(COLUMN_TYPECODES[column['kind']])
+                # A truncated file would otherwise decode into short columns without complaint
+                if column['offset'] + column['length'] > len(data) or \
+                        column['length'] != header['count'] * values.itemsize:
+                    raise ValueError(f"Snapshot column {column['name']} is truncated")
+                values.frombytes(data[column['offset']:column['offset'] + column['length']])
+                if swap:
+                    values.byteswap()
+                columns[column['name']] = values
+                if column['kind'] == 'str':
+                    start = column['table_offset']
+                    if start + column['table_length'] > len(data):
+                        raise ValueError(f"Snapshot table {column['name']} is truncated")
+                    raw = bytes(data[start:start + column['table_length']])
+                    tables[column['name']] = raw.decode('utf-8').split('\x00') if column['table_size'] else []
+    finally:
+        view.release()
+
+    return InstrumentColumns(columns, tables, header['count']), header
+
+
+def save_snapshot(path: str, instruments: InstrumentColumns, fetched_at: float, exchange: str = 'NSE') -> str:
+    """Atomically write a catalog snapshot to path and return its version"""
+    payload, version = encode_snapshot(instruments, fetched_at, exchange)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return version
+
+
+def load_snapshot(path: str) -> Optional[Tuple[InstrumentColumns, Dict]]:
+    """Memory-map and decode a snapshot, or return None if there is no usable one"""
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return decode_snapshot(mm)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable instrument snapshot {path}: {e}")
+        return None
+
+
+class InstrumentCatalog:
+    """Stale-while-revalidate cache of one exchange's instrument catalog.
+
+    Readers always get the current registry straight away; once it is older
+    than ttl a single background greenlet refetches it from Kite, persists a
+    snapshot and swaps the new registry in. Concurrent expired readers share
+    that one in-flight fetch instead of each calling kite.instruments().
+
+    Every swap that changes the version records a diff against the previous
+    catalog, so clients can sync with changes_since() instead of a full dump.
+    """
+
+    def __init__(self, fetch: Callable[[str], List[Dict]], exchange: str = 'NSE',
+                 ttl: float = 3600, snapshot_path: Optional[str] = None,
+                 retry_interval: float = 60, searchable: bool = False):
+        self.fetch = fetch
+        self.exchange = exchange
+        self.searchable = searchable
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.retry_interval = retry_interval
+        self.registry = InstrumentRegistry()
+        self.fetched_at: Optional[float] = None
+        self._refresh: Optional[gevent.Greenlet] = None
+        self._failed_at: Optional[float] = None
+        self.history: List[Dict] = []
+
+    def expired(self) -> bool:
+        """True when the catalog is missing or older than ttl"""
+        return self.fetched_at is None or time.time() - self.fetched_at >= self.ttl
+
+    def _swap(self, instruments: InstrumentColumns, fetched_at: float, version: str):
+        # Build the indexes first so readers never see a half-built registry
+        previous = self.registry
+        registry = InstrumentRegistry(instruments, version)
+        # Searched catalogs get their n-gram index here, in the refresh greenlet, not on the next search
+        if self.searchable or previous.search_index_built:
+            registry.search_index
+        if previous.version and previous.version != version:
+            try:
+                self.history.append(registry.diff(previous))
+                del self.history[:-CHANGE_HISTORY_SIZE]
+            except Exception as e:
+                print(f"Error diffing {self.exchange} instruments: {e}")
+        self.registry = registry
+        self.fetched_at = fetched_at
+
+    def load_snapshot(self) -> bool:
+        """Load the persisted catalog, if any, so the first request does not wait on Kite"""
+        if not self.snapshot_path:
+            return False
+        snapshot = load_snapshot(self.snapshot_path)
+        if not snapshot:
+            return False
+        instruments, header = snapshot
+        self._swap(instruments, header['fetched_at'], header['version'])
+        print(f"Loaded {len(instruments)} {self.exchange} instruments from snapshot {header['version']}")
+        return True
+
+    def refresh(self) -> InstrumentRegistry:
+        """Download the catalog from Kite, persist a snapshot and swap it in"""
+        # Convert straight away so the per-row dicts from Kite can be freed
+        instruments = InstrumentColumns.from_rows(self.fetch(self.exchange))
+        fetched_at = time.time()
+        version = None
+        if self.snapshot_path:
+            try:
+                version = save_snapshot(self.snapshot_path, instruments, fetched_at, self.exchange)
+            except Exception as e:
+                print(f"Error saving {self.exchange} instrument snapshot: {e}")
+        if version is None:
+            _, version = encode_snapshot(instruments, fetched_at, self.exchange)
+        self._swap(instruments, fetched_at, version)
+        self._failed_at = None
+        print(f"Fetched {len(instruments)} instruments from {self.exchange} (version {version})")
+        return self.registry
+
+    def _refresh_safely(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self._failed_at = time.time()
+            print(f"Error fetching {self.exchange} instruments: {e}")
+
+    def refresh_async(self) -> Optional[gevent.Greenlet]:
+        """Start a background refresh unless one is already in flight.
+
+        Returns the in-flight greenlet, or None while backing off after a
+        failed fetch.
+        """
+        if self._refresh is not None and not self._refresh.ready():
+            return self._refresh
+        if self._failed_at is not None and time.time() - self._failed_at < self.retry_interval:
+            return None
+        self._refresh = gevent.spawn(self._refresh_safely)
+        return self._refresh
+
+    def changes_since(self, version: str) -> Optional[Dict]:
+        """Combined diff from an earlier version to the current one.
+
+        Returns None when that version is not in the retained history, in
+        which case the client has to resync from a full dump.
+        """
+        current = self.registry.version
+        if version == current:
+            return {'from': version, 'to': current, 'added': [], 'removed': [], 'modified': []}
+
+        start = None
+        for pos in range(len(self.history) - 1, -1, -1):
+            if self.history[pos]['from'] == version:
+                start = pos
+                break
+        if start is None:
+            return None
+
+        # Fold the diffs in order; per token the state is ('added'|'modified', row) or ('removed', None)
+        changes: Dict[int, tuple] = {}
+        for diff in self.history[start:]:
+            for row in diff['added']:
+                previous = changes.get(row['instrument_token'])
+                state = 'modified' if previous and previous[0] == 'removed' else 'added'
+                changes[row['instrument_token']] = (state, row)
+            for token in diff['removed']:
+                previous = changes.get(token)
+                if previous and previous[0] == 'added':
+                    del changes[token]
+                else:
+                    changes[token] = ('removed', None)
+            for row in diff['modified']:
+                previous = changes.get(row['instrument_token'])
+                state = 'added' if previous and previous[0] == 'added' else 'modified'
+                changes[row['instrument_token']] = (state, row)
+
+        return {
+            'from': version,
+            'to': current,
+            'added': [row for state, row in changes.values() if state == 'added'],
+            'removed': [token for token, (state, _) in changes.items() if state == 'removed'],
+            'modified': [row for state, row in changes.values() if state == 'modified'],
+        }
+
+    def get(self) -> InstrumentRegistry:
+        """Current registry, kicking off a background refresh when it has expired"""
+        registry = self.registry
+        if self.expired():
+            pending = self.refresh_async()
+            if not registry.instruments and pending is not None:
+                # Cold start with no snapshot: wait on the shared fetch
+                pending.join()
+                registry = self.registry
+        return registry
+
+
+class ExchangeCatalogs:
+    """One InstrumentCatalog per exchange, created and loaded on first use.
+
+    Each exchange keeps its own snapshot file, so a worker that only serves
+    NSE equities never pays for the ~100k NFO contracts.
+    """
+
+    def __init__(self, fetch: Callable[[str], List[Dict]], ttl: float = 3600,
+                 snapshot_dir: Optional[str] = None, exchanges=SUPPORTED_EXCHANGES,
+                 search_exchanges=('NSE',)):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.exchanges = tuple(exchanges)
+        self.search_exchanges = tuple(search_exchanges)
+        self._catalogs: Dict[str, InstrumentCatalog] = {}
+
+    def snapshot_path(self, exchange: str) -> Optional[str]:
+        if not self.snapshot_dir:
+            return None
+        return os.path.join(self.snapshot_dir, f'instruments_{exchange}.bin')
+
+    def catalog(self, exchange: str = 'NSE') -> InstrumentCatalog:
+        """The catalog for an exchange, loading its snapshot the first time it is asked for"""
+        exchange = exchange.upper()
+        if exchange not in self.exchanges:
+            raise ValueError(f"Unsupported exchange '{exchange}'. Must be one of: {', '.join(self.exchanges)}")
+        catalog = self._catalogs.get(exchange)
+        if catalog is None:
+            catalog = InstrumentCatalog(self.fetch, exchange, ttl=self.ttl,
+                                        snapshot_path=self.snapshot_path(exchange),
+                                        searchable=exchange in self.search_exchanges)
+            catalog.load_snapshot()
+            self._catalogs[exchange] = catalog
+        return catalog
+
+    def registry(self, exchange: str = 'NSE') -> InstrumentRegistry:
+        return self.catalog(exchange).get()
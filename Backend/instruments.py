@@ -0,0 +1,417 @@
+"""Instrument catalog helpers shared by the API handlers and the ticker callbacks."""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+NGRAM_SIZES = (1, 2, 3)
+DEFAULT_SEARCH_LIMIT = 20
+OPTION_TYPES = ('CE', 'PE')
+
+# last_price in the instrument dump is just the previous close, so it changes
+# daily for nearly every row; it does not count as a catalog modification
+DIFF_IGNORED_COLUMNS = ('last_price',)
+
+# Columns returned by kite.instruments() and how each one is stored
+INSTRUMENT_COLUMNS = [
+    ('instrument_token', 'int'),
+    ('exchange_token', 'numstr'),
+    ('tradingsymbol', 'str'),
+    ('name', 'str'),
+    ('last_price', 'float'),
+    ('expiry', 'date'),
+    ('strike', 'float'),
+    ('tick_size', 'float'),
+    ('lot_size', 'int'),
+    ('instrument_type', 'str'),
+    ('segment', 'str'),
+    ('exchange', 'str'),
+]
+
+# int/float columns are plain arrays, expiries are date ordinals (0 = none),
+# numeric strings such as exchange_token are stored as ints and strings are
+# codes into a per-column table of distinct values
+COLUMN_TYPECODES = {'int': 'q', 'numstr': 'q', 'float': 'd', 'date': 'i', 'str': 'I'}
+
+
+class InstrumentColumns:
+    """Column-oriented, memory-compact instrument table.
+
+    Behaves like the list of dicts kite.instruments() returns (len, index,
+    slice, iterate), but rows are only materialized when they are read.
+    """
+
+    def __init__(self, columns: Dict[str, array], tables: Dict[str, List[str]], size: int):
+        self.columns = columns
+        self.tables = tables
+        self.size = size
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> 'InstrumentColumns':
+        """Build the columns from kite.instruments() style dicts"""
+        columns = {name: array(COLUMN_TYPECODES[kind]) for name, kind in INSTRUMENT_COLUMNS}
+        lookups: Dict[str, Dict[str, int]] = {name: {} for name, kind in INSTRUMENT_COLUMNS if kind == 'str'}
+        size = 0
+        for row in rows:
+            size += 1
+            for name, kind in INSTRUMENT_COLUMNS:
+                value = row.get(name)
+                if kind == 'str':
+                    value = '' if value is None else str(value)
+                    lookup = lookups[name]
+                    code = lookup.get(value)
+                    if code is None:
+                        code = lookup[value] = len(lookup)
+                    columns[name].append(code)
+                elif kind == 'date':
+                    # Kite reports "no expiry" as an empty string
+                    columns[name].append(value.toordinal() if isinstance(value, date) else 0)
+                elif kind == 'int':
+                    columns[name].append(int(value or 0))
+                elif kind == 'numstr':
+                    try:
+                        columns[name].append(int(value or 0))
+                    except (TypeError, ValueError):
+                        columns[name].append(0)
+                else:
+                    columns[name].append(float(value or 0))
+        tables = {name: list(lookup) for name, lookup in lookups.items()}
+        return cls(columns, tables, size)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for idx in range(self.size):
+            yield self.row(idx)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(idx) for idx in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('instrument index out of range')
+        return self.row(index)
+
+    def value(self, name: str, idx: int):
+        """Read a single field without materializing the whole row"""
+        raw = self.columns[name][idx]
+        table = self.tables.get(name)
+        if table is not None:
+            return table[raw]
+        if name == 'expiry':
+            return date.fromordinal(raw) if raw else ''
+        if name == 'exchange_token':
+            return str(raw) if raw else ''
+        return raw
+
+    def row(self, idx: int) -> Dict:
+        """Materialize one instrument as the dict shape Kite returns"""
+        return {name: self.value(name, idx) for name, _ in INSTRUMENT_COLUMNS}
+
+    def strings(self, name: str) -> List[str]:
+        """Decoded values of a string column, one per row"""
+        table = self.tables[name]
+        return [table[code] for code in self.columns[name]]
+
+    def signatures(self, ignore=DIFF_IGNORED_COLUMNS) -> List[tuple]:
+        """Per-row tuples of comparable field values, used to diff two catalogs"""
+        decoded = []
+        for name, kind in INSTRUMENT_COLUMNS:
+            if name in ignore:
+                continue
+            decoded.append(self.strings(name) if kind == 'str' else self.columns[name])
+        return list(zip(*decoded))
+
+
+class InstrumentRegistry:
+    """Hash indexes over one snapshot of the instrument catalog.
+
+    Built once per catalog refresh so handlers can resolve a symbol or a
+    token without walking the full instrument list. Indexes map to row
+    positions in the columnar table rather than holding row dicts; tokens
+    are resolved by bisecting a sorted array, which costs 12 bytes per
+    instrument instead of a dict entry.
+    """
+
+    def __init__(self, instruments=None, version: Optional[str] = None):
+        if not isinstance(instruments, InstrumentColumns):
+            instruments = InstrumentColumns.from_rows(instruments or [])
+        self.instruments = instruments
+        self.version = version
+        self._search_index = None
+
+        columns = instruments.columns
+        symbols = instruments.tables['tradingsymbol']
+        exchanges = instruments.tables['exchange']
+        self._by_symbol: Dict[str, int] = {}
+        # Only a table mixing several exchanges needs a separate EXCHANGE:SYMBOL index
+        self._by_key: Optional[Dict[str, int]] = {} if len(exchanges) > 1 else None
+
+        for idx, code in enumerate(columns['tradingsymbol']):
+            symbol = symbols[code]
+            # Keep the first listing for a bare symbol, matching the old linear scans
+            self._by_symbol.setdefault(symbol, idx)
+            if self._by_key is not None:
+                self._by_key[f"{exchanges[columns['exchange'][idx]]}:{symbol}"] = idx
+
+        tokens = columns['instrument_token']
+        self._token_rows = array('I', sorted(range(len(tokens)), key=tokens.__getitem__))
+        self._sorted_tokens = array('q', (tokens[idx] for idx in self._token_rows))
+
+        # Derivative segments (NFO, CDS, MCX, BFO) get an option chain index
+        instrument_types = instruments.tables['instrument_type']
+        has_options = any(t in OPTION_TYPES for t in instrument_types)
+        self.option_chains = OptionChainIndex(instruments) if has_options else None
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __iter__(self):
+        return iter(self.instruments)
+
+    @property
+    def search_index(self) -> 'SearchIndex':
+        """N-gram search index, built on first use (derivative segments rarely need it)"""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.instruments)
+        return self._search_index
+
+    @property
+    def search_index_built(self) -> bool:
+        return self._search_index is not None
+
+    def _token_index(self, instrument_token: int) -> Optional[int]:
+        pos = bisect_left(self._sorted_tokens, instrument_token)
+        if pos < len(self._sorted_tokens) and self._sorted_tokens[pos] == instrument_token:
+            return self._token_rows[pos]
+        return None
+
+    def _index_of(self, symbol: str, exchange: Optional[str] = None) -> Optional[int]:
+        if not symbol:
+            return None
+        symbol = symbol.upper()
+        if not exchange:
+            return self._by_symbol.get(symbol)
+        exchange = exchange.upper()
+        if self._by_key is not None:
+            return self._by_key.get(f"{exchange}:{symbol}")
+        idx = self._by_symbol.get(symbol)
+        if idx is None or self.instruments.value('exchange', idx) != exchange:
+            return None
+        return idx
+
+    def get_by_symbol(self, symbol: str, exchange: Optional[str] = None) -> Optional[Dict]:
+        """Look up an instrument by tradingsymbol, optionally pinned to an exchange"""
+        idx = self._index_of(symbol, exchange)
+        return None if idx is None else self.instruments.row(idx)
+
+    def get_by_token(self, instrument_token) -> Optional[Dict]:
+        """Look up an instrument by its instrument_token"""
+        try:
+            idx = self._token_index(int(instrument_token))
+        except (TypeError, ValueError):
+            return None
+        return None if idx is None else self.instruments.row(idx)
+
+    def symbol_for_token(self, instrument_token) -> Optional[str]:
+        """Tradingsymbol for a token without materializing the row (ticker hot path)"""
+        idx = self._token_index(instrument_token)
+        return None if idx is None else self.instruments.value('tradingsymbol', idx)
+
+    def resolve_many(self, symbols: List[str], exchange: Optional[str] = None) -> Dict[str, Dict]:
+        """Resolve a list of symbols, returning {SYMBOL: instrument} for the ones found"""
+        resolved = {}
+        for symbol in symbols:
+            inst = self.get_by_symbol(symbol, exchange)
+            if inst:
+                resolved[symbol.upper()] = inst
+        return resolved
+
+    def search(self, query: str, limit: Optional[int] = DEFAULT_SEARCH_LIMIT) -> List[Dict]:
+        """Ranked symbol/name search, see SearchIndex.search"""
+        return self.search_index.search(query, limit)
+
+    def diff(self, previous: 'InstrumentRegistry') -> Dict:
+        """Changes from a previous registry to this one, by instrument_token.
+
+        Returns {'from', 'to', 'added': [row], 'removed': [token], 'modified': [row]}.
+        """
+        old_sigs = previous.instruments.signatures()
+        new_sigs = self.instruments.signatures()
+        old_tokens, old_rows = previous._sorted_tokens, previous._token_rows
+        new_tokens, new_rows = self._sorted_tokens, self._token_rows
+
+        added, removed, modified = [], [], []
+        i = j = 0
+        # Merge-walk the two sorted token arrays
+        while i < len(old_tokens) or j < len(new_tokens):
+            if j >= len(new_tokens) or (i < len(old_tokens) and old_tokens[i] < new_tokens[j]):
+                removed.append(old_tokens[i])
+                i += 1
+            elif i >= len(old_tokens) or new_tokens[j] < old_tokens[i]:
+                added.append(self.instruments.row(new_rows[j]))
+                j += 1
+            else:
+                if old_sigs[old_rows[i]] != new_sigs[new_rows[j]]:
+                    modified.append(self.instruments.row(new_rows[j]))
+                i += 1
+                j += 1
+
+        return {'from': previous.version, 'to': self.version,
+                'added': added, 'removed': removed, 'modified': modified}
+
+
+class OptionChainIndex:
+    """Options sorted by underlying -> expiry -> strike -> CE/PE.
+
+    Rows are kept in one sorted array with parallel expiry/strike arrays,
+    so an underlying resolves to a contiguous range and expiries and
+    strikes inside it are found with a bisect (O(log n)).
+    """
+
+    def __init__(self, instruments: InstrumentColumns):
+        self.instruments = instruments
+        columns = instruments.columns
+        names = instruments.tables['name']
+        types = instruments.tables['instrument_type']
+        option_codes = {code for code, t in enumerate(types) if t in OPTION_TYPES}
+
+        type_column = columns['instrument_type']
+        name_column = columns['name']
+        expiry_column = columns['expiry']
+        strike_column = columns['strike']
+        rows = [idx for idx, code in enumerate(type_column) if code in option_codes]
+        rows.sort(key=lambda idx: (names[name_column[idx]], expiry_column[idx],
+                                   strike_column[idx], types[type_column[idx]]))
+
+        self.rows = array('I', rows)
+        self.expiries = array('i', (expiry_column[idx] for idx in rows))
+        self.strikes = array('d', (strike_column[idx] for idx in rows))
+        self.ranges: Dict[str, tuple] = {}
+        for pos, idx in enumerate(rows):
+            underlying = names[name_column[idx]]
+            start, _ = self.ranges.get(underlying, (pos, pos))
+            self.ranges[underlying] = (start, pos + 1)
+
+    def expiry_dates(self, underlying: str) -> List[date]:
+        """Distinct expiries listed for an underlying, earliest first"""
+        lo, hi = self.ranges.get((underlying or '').upper(), (0, 0))
+        result = []
+        while lo < hi:
+            ordinal = self.expiries[lo]
+            result.append(date.fromordinal(ordinal))
+            lo = bisect_right(self.expiries, ordinal, lo, hi)
+        return result
+
+    def nearest_expiry(self, underlying: str, on_or_after: date) -> Optional[date]:
+        """First expiry on or after a date"""
+        lo, hi = self.ranges.get((underlying or '').upper(), (0, 0))
+        pos = bisect_left(self.expiries, on_or_after.toordinal(), lo, hi)
+        return date.fromordinal(self.expiries[pos]) if pos < hi else None
+
+    def chain(self, underlying: str, expiry: date, strike_min: Optional[float] = None,
+              strike_max: Optional[float] = None) -> List[Dict]:
+        """Strikes for one expiry as [{'strike', 'CE', 'PE'}], instruments materialized"""
+        lo, hi = self.ranges.get((underlying or '').upper(), (0, 0))
+        ordinal = expiry.toordinal()
+        lo, hi = bisect_left(self.expiries, ordinal, lo, hi), bisect_right(self.expiries, ordinal, lo, hi)
+        if strike_min is not None:
+            lo = bisect_left(self.strikes, strike_min, lo, hi)
+        if strike_max is not None:
+            hi = bisect_right(self.strikes, strike_max, lo, hi)
+
+        chain = []
+        for pos in range(lo, hi):
+            inst = self.instruments.row(self.rows[pos])
+            if not chain or chain[-1]['strike'] != inst['strike']:
+                chain.append({'strike': inst['strike'], 'CE': None, 'PE': None})
+            chain[-1][inst['instrument_type']] = inst
+        return chain
+
+
+class SearchIndex:
+    """Prebuilt n-gram and prefix index over tradingsymbol and name.
+
+    Results are ranked exact symbol, symbol prefix, name prefix, then
+    substring matches in catalog order.
+    """
+
+    def __init__(self, instruments: InstrumentColumns):
+        self.instruments = instruments
+        self.symbols: List[str] = [s.upper() for s in instruments.strings('tradingsymbol')]
+        self.names: List[str] = [n.upper() for n in instruments.strings('name')]
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+
+        for idx, (symbol, name) in enumerate(zip(self.symbols, self.names)):
+            self.exact.setdefault(symbol, idx)
+
+            grams = set()
+            for text in (symbol, name):
+                for n in NGRAM_SIZES:
+                    for i in range(len(text) - n + 1):
+                        grams.add(text[i:i + n])
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array('I')
+                posting.append(idx)
+
+        # Sorted (text, idx) pairs give prefix matches with a bisect
+        self.symbol_prefixes = sorted((sym, idx) for idx, sym in enumerate(self.symbols) if sym)
+        self.name_prefixes = sorted((name, idx) for idx, name in enumerate(self.names) if name)
+
+    def _prefix_matches(self, sorted_pairs, query):
+        pos = bisect_left(sorted_pairs, (query, -1))
+        while pos < len(sorted_pairs) and sorted_pairs[pos][0].startswith(query):
+            yield sorted_pairs[pos][1]
+            pos += 1
+
+    def _substring_matches(self, query):
+        max_n = NGRAM_SIZES[-1]
+        if len(query) <= max_n:
+            # The posting list for the query itself is exactly the match set
+            yield from self.postings.get(query, ())
+            return
+
+        # Scan the rarest trigram's postings and verify the full substring
+        candidates = None
+        for i in range(len(query) - max_n + 1):
+            posting = self.postings.get(query[i:i + max_n])
+            if not posting:
+                return
+            if candidates is None or len(posting) < len(candidates):
+                candidates = posting
+        for idx in candidates:
+            if query in self.symbols[idx] or query in self.names[idx]:
+                yield idx
+
+    def search(self, query: str, limit: Optional[int] = DEFAULT_SEARCH_LIMIT) -> List[Dict]:
+        """Return instruments matching query, best matches first.
+
+        limit=None returns every match (used for paginated listings).
+        """
+        query = (query or '').strip().upper()
+        if not query:
+            return []
+
+        seen = set()
+        results = []
+
+        def tiers():
+            if query in self.exact:
+                yield self.exact[query]
+            yield from self._prefix_matches(self.symbol_prefixes, query)
+            yield from self._prefix_matches(self.name_prefixes, query)
+            yield from self._substring_matches(query)
+
+        for idx in tiers():
+            if idx in seen:
+                continue
+            seen.add(idx)
+            results.append(self.instruments.row(idx))
+            if limit is not None and len(results) >= limit:
+                break
+        return results
@@ -0,0 +1,204 @@
+"""Rate-limited, prioritised scheduling of Kite REST calls."""
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, List, Optional
+
+import gevent
+from gevent.event import AsyncResult, Event
+
+# Endpoint classes Kite rate-limits separately
+ENDPOINT_QUOTE = 'quote'
+ENDPOINT_HISTORICAL = 'historical'
+ENDPOINT_DEFAULT = 'default'
+
+# Kite's published per-second limits for each endpoint class
+DEFAULT_RATE_LIMITS = {
+    ENDPOINT_QUOTE: 1.0,
+    ENDPOINT_HISTORICAL: 3.0,
+    ENDPOINT_DEFAULT: 10.0,
+}
+
+# Lower runs first: user-facing requests go ahead of warmers and backfills
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether a Kite error is a 429 Too Many Requests"""
+    if getattr(error, 'code', None) == 429:
+        return True
+    return 'too many requests' in str(error).lower()
+
+
+class TokenBucket:
+    """Token bucket refilled at rate per second, holding at most burst tokens"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token can be taken (0 when one is available now)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Hold every caller back for seconds, e.g. after Kite answered 429"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+
+class _Job:
+    def __init__(self, fn: Callable, args, kwargs, priority: int):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.sequence = 0
+        self.result = AsyncResult()
+
+
+class _EndpointQueue:
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.heap: List = []
+        self.wakeup = Event()
+        self.dispatcher: Optional[gevent.Greenlet] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.started = 0
+        self.throttled = 0
+        self.failures = 0
+        self.consecutive_throttles = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+
+class KiteScheduler:
+    """One queue per Kite endpoint class, drained no faster than its rate limit.
+
+    Calls are queued by (priority, arrival) and a dispatcher greenlet per
+    endpoint class releases them as the class's token bucket allows. A call
+    Kite rejects with 429 blocks the whole class for an exponentially
+    growing backoff and is requeued ahead of later arrivals, up to
+    max_retries times.
+    """
+
+    def __init__(self, rate_limits: Optional[Dict[str, float]] = None, burst: float = 1,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30):
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queues: Dict[str, _EndpointQueue] = {}
+        self._sequence = itertools.count()
+
+    def _queue(self, endpoint: str) -> _EndpointQueue:
+        queue = self._queues.get(endpoint)
+        if queue is None:
+            if endpoint not in self.rate_limits:
+                raise ValueError(f"Unknown Kite endpoint class '{endpoint}'")
+            queue = self._queues[endpoint] = _EndpointQueue(self.rate_limits[endpoint], self.burst)
+        if queue.dispatcher is None or queue.dispatcher.dead:
+            queue.dispatcher = gevent.spawn(self._dispatch, queue)
+        return queue
+
+    def _push(self, queue: _EndpointQueue, job: _Job):
+        heapq.heappush(queue.heap, (job.priority, job.sequence, job))
+        queue.wakeup.set()
+
+    def _dispatch(self, queue: _EndpointQueue):
+        while True:
+            if not queue.heap:
+                queue.wakeup.clear()
+                queue.wakeup.wait()
+                continue
+            delay = queue.bucket.delay()
+            if delay > 0:
+                # Sleep, then look again: a higher-priority call may have arrived meanwhile
+                gevent.sleep(delay)
+                continue
+            queue.bucket.take()
+            _, _, job = heapq.heappop(queue.heap)
+            queue.in_flight += 1
+            gevent.spawn(self._run, queue, job)
+
+    def _run(self, queue: _EndpointQueue, job: _Job):
+        if job.attempts == 0:
+            waited = time.monotonic() - job.enqueued_at
+            queue.started += 1
+            queue.waited += waited
+            queue.max_wait = max(queue.max_wait, waited)
+        job.attempts += 1
+        queue.calls += 1
+        try:
+            value = job.fn(*job.args, **job.kwargs)
+        except Exception as e:
+            if is_rate_limited(e) and job.attempts <= self.max_retries:
+                queue.throttled += 1
+                queue.consecutive_throttles += 1
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** (queue.consecutive_throttles - 1))
+                print(f"Kite rate limit hit, backing off {backoff:.1f}s: {e}")
+                queue.bucket.block(backoff)
+                # Retries keep their priority and jump ahead of anything queued after them
+                self._push(queue, job)
+            else:
+                queue.failures += 1
+                job.result.set_exception(e)
+        else:
+            queue.consecutive_throttles = 0
+            job.result.set(value)
+        finally:
+            queue.in_flight -= 1
+
+    def call(self, endpoint: str, fn: Callable, *args, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        """Run fn(*args, **kwargs) once the endpoint class's limit allows, and return its result"""
+        queue = self._queue(endpoint)
+        job = _Job(fn, args, kwargs, priority)
+        job.sequence = next(self._sequence)
+        self._push(queue, job)
+        return job.result.get()
+
+    def wrap(self, endpoint: str, fn: Callable, priority: int = PRIORITY_INTERACTIVE) -> Callable:
+        """fn with every call routed through the scheduler"""
+        def scheduled(*args, **kwargs):
+            return self.call(endpoint, fn, *args, priority=priority, **kwargs)
+        return scheduled
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        stats = {}
+        for endpoint, queue in self._queues.items():
+            queued = [job for _, _, job in queue.heap]
+            stats[endpoint] = {
+                'rate_limit': queue.bucket.rate,
+                'queue_depth': len(queued),
+                'queued_interactive': sum(1 for job in queued if job.priority <= PRIORITY_INTERACTIVE),
+                'in_flight': queue.in_flight,
+                'calls': queue.calls,
+                'throttled': queue.throttled,
+                'failures': queue.failures,
+                'oldest_wait': round(max((now - job.enqueued_at for job in queued), default=0.0), 3),
+                'avg_wait': round(queue.waited / queue.started, 3) if queue.started else 0.0,
+                'max_wait': round(queue.max_wait, 3),
+                'backoff_remaining': round(max(0.0, queue.bucket.blocked_until - now), 3),
+            }
+        return stats
@@ -0,0 +1,7 @@
+"""Indian Standard Time, shared by every module that stamps or buckets candles."""
+from datetime import timedelta, timezone
+
+# IST has no daylight saving, so one fixed offset replaces per-value pytz conversion
+IST_OFFSET_SECONDS = 19800
+IST_OFFSET = timedelta(seconds=IST_OFFSET_SECONDS)
+IST = timezone(IST_OFFSET)
@@ -0,0 +1,313 @@
+"""Quote lookups shared by the stock, batch and wishlist endpoints."""
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.pool import Pool
+
+# Kite accepts up to 500 instruments per quote call
+KITE_QUOTE_BATCH_LIMIT = 500
+
+# Where a quote came from, reported alongside each answer
+SOURCE_TICK = 'tick'
+SOURCE_CACHE = 'cache'
+SOURCE_KITE = 'kite'
+
+# Kite quote modes, cheapest first: kite.ltp, kite.ohlc and the full kite.quote
+MODE_LTP = 'ltp'
+MODE_OHLC = 'ohlc'
+MODE_FULL = 'full'
+QUOTE_MODES = (MODE_LTP, MODE_OHLC, MODE_FULL)
+
+# Fields each cheaper mode can answer (change fields are derived from ohlc.close)
+LTP_FIELDS = frozenset({'instrument_token', 'last_price'})
+OHLC_FIELDS = LTP_FIELDS | {'ohlc', 'change', 'change_percent'}
+# What an ltp or ohlc quote holds, to trim ticks and full cached quotes served in those modes
+MODE_FIELDS = {MODE_LTP: sorted(LTP_FIELDS), MODE_OHLC: sorted(OHLC_FIELDS)}
+
+
+def quote_key(instrument: Dict) -> str:
+    """Kite quote key ('EXCHANGE:SYMBOL') for an instrument"""
+    return f"{instrument['exchange']}:{instrument['tradingsymbol']}"
+
+
+def quote_mode_for_fields(fields: Optional[Iterable[str]]) -> str:
+    """Cheapest quote mode that can answer every requested field"""
+    if not fields:
+        return MODE_FULL
+    fields = set(fields)
+    if fields <= LTP_FIELDS:
+        return MODE_LTP
+    if fields <= OHLC_FIELDS:
+        return MODE_OHLC
+    return MODE_FULL
+
+
+def project_quote(quote_data: Optional[Dict], fields: Optional[Iterable[str]]) -> Optional[Dict]:
+    """Trim a quote to the requested fields (all fields when none are given)"""
+    if not quote_data or not fields:
+        return quote_data
+    return {field: quote_data.get(field) for field in fields}
+
+
+def add_change_fields(quote_data: Optional[Dict]) -> Optional[Dict]:
+    """Add change and change_percent (against the previous close) to a quote in place"""
+    if not quote_data:
+        return quote_data
+    last_price = quote_data.get('last_price')
+    ohlc = quote_data.get('ohlc', {})
+    close = ohlc.get('close') if ohlc else quote_data.get('close')
+    if close is None:
+        close = quote_data.get('close')
+    if last_price is not None and close not in (None, 0):
+        quote_data['change'] = last_price - close
+        quote_data['change_percent'] = ((last_price - close) / close) * 100
+    return quote_data
+
+
+def tick_to_quote(tick: Dict) -> Dict:
+    """Reshape a KiteTicker MODE_FULL tick into the dict kite.quote() returns"""
+    ohlc = tick.get('ohlc') or {}
+    last_price = tick.get('last_price')
+    close = ohlc.get('close')
+    quote = {
+        'instrument_token': tick.get('instrument_token'),
+        'timestamp': tick.get('exchange_timestamp'),
+        'last_trade_time': tick.get('last_trade_time'),
+        'last_price': last_price,
+        'last_quantity': tick.get('last_traded_quantity'),
+        'buy_quantity': tick.get('total_buy_quantity'),
+        'sell_quantity': tick.get('total_sell_quantity'),
+        'volume': tick.get('volume_traded'),
+        'average_price': tick.get('average_traded_price'),
+        'oi': tick.get('oi'),
+        'oi_day_high': tick.get('oi_day_high'),
+        'oi_day_low': tick.get('oi_day_low'),
+        'net_change': (last_price - close) if last_price is not None and close else 0,
+        'ohlc': dict(ohlc),
+    }
+    if 'depth' in tick:
+        quote['depth'] = tick['depth']
+    return quote
+
+
+class QuoteService:
+    """Quotes answered from live tick state, a short-TTL cache, or Kite.
+
+    Instruments the KiteTicker streams in MODE_FULL are answered from their
+    latest tick in ticks (a TickState) while it is younger than tick_max_age. Everything else goes
+    through a cache of Kite results that expire after cache_ttl, and only
+    the misses are fetched, in a single call for the requested mode. A
+    cached fuller quote also answers cheaper modes.
+
+    fetchers maps each mode to a callable with kite.quote's list contract,
+    e.g. {'full': kite.quote, 'ohlc': kite.ohlc, 'ltp': kite.ltp}; modes
+    without a fetcher fall back to the next fuller one.
+    """
+
+    def __init__(self, fetchers: Dict[str, Callable[[List[str]], Dict]], ticks=None, tick_max_age: float = 5,
+                 cache_ttl: float = 3, max_cache_entries: int = 5000):
+        self.fetchers = fetchers
+        self.ticks = ticks
+        self.tick_max_age = tick_max_age
+        self.cache_ttl = cache_ttl
+        self.max_cache_entries = max_cache_entries
+        self.cache: Dict[str, Tuple[float, Dict, int]] = {}
+        self.served = {SOURCE_TICK: 0, SOURCE_CACHE: 0, SOURCE_KITE: 0, 'missing': 0}
+
+    def _from_tick(self, instrument: Dict, now: float) -> Optional[Dict]:
+        if self.ticks is None:
+            return None
+        entry = self.ticks.raw_tick(instrument['instrument_token'])
+        if entry is None or now - entry[0] > self.tick_max_age:
+            return None
+        # LTP/quote-mode ticks lack ohlc; only full ticks stand in for a quote
+        if 'ohlc' not in entry[1]:
+            return None
+        return tick_to_quote(entry[1])
+
+    def _prune_cache(self, now: float):
+        if len(self.cache) <= self.max_cache_entries:
+            return
+        for key in [k for k, (at, _, _) in self.cache.items() if now - at > self.cache_ttl]:
+            del self.cache[key]
+        # Still over after one large batch: drop the oldest quotes even if they are fresh
+        excess = len(self.cache) - self.max_cache_entries
+        if excess > 0:
+            for key, _ in sorted(self.cache.items(), key=lambda item: item[1][0])[:excess]:
+                del self.cache[key]
+
+    def _fetcher(self, mode: str) -> Tuple[str, Callable[[List[str]], Dict]]:
+        for candidate in QUOTE_MODES[QUOTE_MODES.index(mode):]:
+            if candidate in self.fetchers:
+                return candidate, self.fetchers[candidate]
+        raise ValueError(f"No quote fetcher for mode '{mode}'")
+
+    def get_quotes(self, instruments: List[Dict], mode: str = MODE_FULL) -> Dict[str, Tuple[Optional[Dict], Optional[str]]]:
+        """Quote a list of instruments in the given mode.
+
+        Returns {quote_key: (quote, source)}; quote is a fresh dict the caller
+        may modify, and (None, None) marks an instrument Kite had no quote for.
+        """
+        level = QUOTE_MODES.index(mode)
+        now = time.time()
+        results: Dict[str, Tuple[Optional[Dict], Optional[str]]] = {}
+        misses = []
+        for instrument in instruments:
+            key = quote_key(instrument)
+            if key in results:
+                continue
+            quote = self._from_tick(instrument, now)
+            if quote is not None:
+                results[key] = (quote, SOURCE_TICK)
+                continue
+            cached = self.cache.get(key)
+            if cached is not None and now - cached[0] <= self.cache_ttl and cached[2] >= level:
+                results[key] = (dict(cached[1]), SOURCE_CACHE)
+                continue
+            misses.append(key)
+
+        if misses:
+            fetch_mode, fetch = self._fetcher(mode)
+            fetched_level = QUOTE_MODES.index(fetch_mode)
+            fetched = fetch(misses) or {}
+            fetched_at = time.time()
+            for key in misses:
+                quote = fetched.get(key)
+                if quote is None:
+                    results[key] = (None, None)
+                    continue
+                # Never let a cheaper answer replace a fresher fuller one in the cache
+                cached = self.cache.get(key)
+                if cached is None or cached[2] <= fetched_level or fetched_at - cached[0] > self.cache_ttl:
+                    self.cache[key] = (fetched_at, quote, fetched_level)
+                results[key] = (dict(quote), SOURCE_KITE)
+            self._prune_cache(fetched_at)
+
+        for quote, source in results.values():
+            self.served[source or 'missing'] += 1
+        return results
+
+    def get_quote(self, instrument: Dict, mode: str = MODE_FULL) -> Tuple[Optional[Dict], Optional[str]]:
+        """Quote a single instrument, returning (quote, source)"""
+        return self.get_quotes([instrument], mode)[quote_key(instrument)]
+
+    def get_quotes_for_fields(self, instruments: List[Dict], fields: Iterable[str]) -> Dict[str, Tuple[Optional[Dict], Optional[str]]]:
+        """Quote instruments with the cheapest mode covering fields, each quote trimmed to them"""
+        fields = list(fields)
+        quotes = self.get_quotes(instruments, quote_mode_for_fields(fields))
+        return {key: (project_quote(add_change_fields(quote), fields), source)
+                for key, (quote, source) in quotes.items()}
+
+    def iter_quotes(self, instruments: List[Dict], mode: str = MODE_FULL,
+                    chunk_size: int = KITE_QUOTE_BATCH_LIMIT, concurrency: int = 4):
+        """Quote a large list in chunks fetched concurrently.
+
+        Yields each chunk's {quote_key: (quote, source)} as soon as it is
+        ready; a chunk that fails comes back as (None, None) entries.
+        """
+        chunks = [instruments[i:i + chunk_size] for i in range(0, len(instruments), chunk_size)]
+
+        def fetch_chunk(chunk):
+            try:
+                return self.get_quotes(chunk, mode)
+            except Exception as e:
+                print(f"Error fetching quote chunk of {len(chunk)} instruments: {e}")
+                return {quote_key(instrument): (None, None) for instrument in chunk}
+
+        if len(chunks) == 1:
+            yield fetch_chunk(chunks[0])
+            return
+        yield from Pool(concurrency).imap_unordered(fetch_chunk, chunks)
+
+    def stats(self) -> Dict:
+        return {
+            'served': dict(self.served),
+            'streaming_instruments': len(self.ticks) if self.ticks is not None else 0,
+            'cached_quotes': len(self.cache),
+        }
+
+
+class _QuoteBatch:
+    def __init__(self):
+        self.keys = set()
+        self.open = True
+        self.queued = False
+        self.result = AsyncResult()
+
+
+class QuoteCoalescer:
+    """Merge kite.quote demands from concurrent greenlets into batched calls.
+
+    The first demand opens a batch that stays open for window seconds; every
+    demand arriving meanwhile joins it, and a single kite.quote call is made
+    for the union of keys, with the results fanned back out to each caller.
+    Batches are capped at max_batch keys (Kite's per-call limit); a demand
+    that does not fit closes the batch early and spills into the next one.
+
+    schedule(send, batch) runs the send once a rate limiter allows, e.g.
+    KiteScheduler.call bound to the quote endpoint. The batch stays open
+    until then, so demands arriving while it waits for a token still join it.
+    """
+
+    def __init__(self, fetch_quotes: Callable[[List[str]], Dict], window: float = 0.005,
+                 max_batch: int = KITE_QUOTE_BATCH_LIMIT, schedule: Optional[Callable] = None):
+        self.fetch_quotes = fetch_quotes
+        self.window = window
+        self.max_batch = max_batch
+        self.schedule = schedule or (lambda send, batch: send(batch))
+        self._batch: Optional[_QuoteBatch] = None
+        self.calls = 0
+        self.demands = 0
+
+    def _close(self, batch: _QuoteBatch):
+        batch.open = False
+        if self._batch is batch:
+            self._batch = None
+
+    def _send(self, batch: _QuoteBatch) -> Dict:
+        self._close(batch)
+        return self.fetch_quotes(list(batch.keys)) or {}
+
+    def _flush(self, batch: _QuoteBatch):
+        if batch.queued:
+            return
+        batch.queued = True
+        self.calls += 1
+        try:
+            batch.result.set(self.schedule(self._send, batch))
+        except Exception as e:
+            batch.result.set_exception(e)
+
+    def _open_batch(self) -> _QuoteBatch:
+        batch = self._batch = _QuoteBatch()
+        gevent.spawn_later(self.window, self._flush, batch)
+        return batch
+
+    def __call__(self, keys: Iterable[str]) -> Dict:
+        """Quote keys through the shared batch, same contract as kite.quote(list)"""
+        self.demands += 1
+        keys = list(dict.fromkeys(keys))
+        batches = []
+        for key in keys:
+            batch = self._batch
+            if batch is None or not batch.open:
+                batch = self._open_batch()
+            elif key not in batch.keys and len(batch.keys) >= self.max_batch:
+                # Full: send it as soon as allowed and start a fresh batch for the overflow
+                self._close(batch)
+                gevent.spawn(self._flush, batch)
+                batch = self._open_batch()
+            batch.keys.add(key)
+            if not batches or batches[-1] is not batch:
+                batches.append(batch)
+
+        fetched = {}
+        for batch in batches:
+            fetched.update(batch.result.get())
+        # A batch carries other callers' keys too; hand back only this caller's
+        return {key: fetched[key] for key in keys if key in fetched}
+
+    def stats(self) -> Dict:
+        return {'demands': self.demands, 'kite_calls': self.calls}
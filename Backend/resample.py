@@ -0,0 +1,162 @@
+"""NumPy resampling of daily candles into week, month, quarter and year bars."""
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from market_time import IST, IST_OFFSET_SECONDS
+
+# Coarser periods, each aggregated from the level before it
+PERIODS = ('week', 'month', 'quarter', 'year')
+PERIOD_SOURCE = {'week': 'day', 'month': 'day', 'quarter': 'month', 'year': 'quarter'}
+
+FIELDS = ('ts', 'open', 'high', 'low', 'close', 'volume')
+
+
+def candles_to_arrays(candles: List[Dict]) -> Dict[str, np.ndarray]:
+    """kite.historical_data style candles (sorted by date) as column arrays, ts in epoch seconds"""
+    return {
+        'ts': np.array([int(c['date'].timestamp()) for c in candles], dtype=np.int64),
+        'open': np.array([c['open'] for c in candles], dtype=np.float64),
+        'high': np.array([c['high'] for c in candles], dtype=np.float64),
+        'low': np.array([c['low'] for c in candles], dtype=np.float64),
+        'close': np.array([c['close'] for c in candles], dtype=np.float64),
+        'volume': np.array([c.get('volume') or 0 for c in candles], dtype=np.int64),
+    }
+
+
+def arrays_to_candles(bars: Dict[str, np.ndarray]) -> List[Dict]:
+    return [
+        {'date': datetime.fromtimestamp(ts, IST), 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}
+        for ts, o, h, l, c, v in zip(bars['ts'].tolist(), bars['open'].tolist(), bars['high'].tolist(),
+                                     bars['low'].tolist(), bars['close'].tolist(), bars['volume'].tolist())
+    ]
+
+
+def period_keys(ts: np.ndarray, period: str) -> np.ndarray:
+    """Integer period index for each IST timestamp (weeks start on Monday)"""
+    days = (ts + IST_OFFSET_SECONDS) // 86400
+    if period == 'week':
+        # 1970-01-01 was a Thursday; shift so Mondays start a new index
+        return (days + 3) // 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if period == 'month':
+        return months
+    if period == 'quarter':
+        return months // 3
+    if period == 'year':
+        return months // 12
+    raise ValueError(f"Unknown period '{period}'")
+
+
+def period_start(day: date, period: str) -> date:
+    """First calendar day of the period containing day"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    raise ValueError(f"Unknown period '{period}'")
+
+
+def period_end(day: date, period: str) -> date:
+    """Last calendar day of the period containing day"""
+    if period == 'week':
+        return period_start(day, 'week') + timedelta(days=6)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[period]
+    start = period_start(day, period)
+    month = start.month - 1 + months
+    return date(start.year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+
+
+def resample(bars: Dict[str, np.ndarray], period: str) -> Dict[str, np.ndarray]:
+    """Aggregate sorted bars into one bar per period.
+
+    Each bar takes the first open, highest high, lowest low, last close and
+    summed volume of its period, stamped with its first session's timestamp.
+    """
+    if len(bars['ts']) == 0:
+        return {field: bars[field][:0] for field in FIELDS}
+    keys = period_keys(bars['ts'], period)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    return {
+        'ts': bars['ts'][starts],
+        'open': bars['open'][starts],
+        'high': np.maximum.reduceat(bars['high'], starts),
+        'low': np.minimum.reduceat(bars['low'], starts),
+        'close': bars['close'][ends],
+        'volume': np.add.reduceat(bars['volume'], starts),
+    }
+
+
+class InstrumentLevels:
+    """Daily bars for one instrument with every coarser level built once up front"""
+
+    def __init__(self, daily: Dict[str, np.ndarray]):
+        self.levels = {'day': daily}
+        for period in PERIODS:
+            self.levels[period] = resample(self.levels[PERIOD_SOURCE[period]], period)
+
+    def bars(self, period: str, start: date, end: date) -> Dict[str, np.ndarray]:
+        """Bars of a level whose period overlaps [start, end]"""
+        level = self.levels[period]
+        lo = int(datetime.combine(period_start(start, period) if period != 'day' else start,
+                                  datetime.min.time(), IST).timestamp())
+        hi = int(datetime.combine(end + timedelta(days=1), datetime.min.time(), IST).timestamp())
+        i, j = np.searchsorted(level['ts'], [lo, hi])
+        return {field: level[field][i:j] for field in FIELDS}
+
+
+class LevelCache:
+    """Per-instrument InstrumentLevels over year-aligned spans of daily candles.
+
+    Spans that end before today never change and are kept until evicted;
+    spans that include today are rebuilt after live_ttl seconds so the
+    current week, month, quarter and year bars pick up the open session.
+    """
+
+    def __init__(self, load_daily: Callable[[int, date, date], List[Dict]], max_instruments: int = 256,
+                 live_ttl: float = 60):
+        self.load_daily = load_daily
+        self.max_instruments = max_instruments
+        self.live_ttl = live_ttl
+        self.entries: 'OrderedDict[int, Tuple[date, date, Optional[float], InstrumentLevels]]' = OrderedDict()
+        self.hits = 0
+        self.builds = 0
+
+    def levels(self, token: int, start: date, end: date) -> InstrumentLevels:
+        today = datetime.now(IST).date()
+        # Cover whole years, plus the weeks that straddle the first January and the last December
+        span_start = period_start(period_start(start, 'year'), 'week')
+        span_end = min(period_end(date(end.year, 12, 31), 'week'), today)
+        entry = self.entries.get(token)
+        if entry is not None:
+            cached_start, cached_end, expires_at, levels = entry
+            fresh = expires_at is None or time.time() < expires_at
+            if cached_start <= span_start and cached_end >= span_end and fresh:
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return levels
+            span_start, span_end = min(span_start, cached_start), max(span_end, cached_end)
+
+        levels = InstrumentLevels(candles_to_arrays(self.load_daily(token, span_start, span_end)))
+        expires_at = time.time() + self.live_ttl if span_end >= today else None
+        self.entries[token] = (span_start, span_end, expires_at, levels)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_instruments:
+            self.entries.popitem(last=False)
+        self.builds += 1
+        return levels
+
+    def get(self, token: int, period: str, start: date, end: date) -> List[Dict]:
+        """Candles for period ('day' or a coarser one) overlapping [start, end]"""
+        return arrays_to_candles(self.levels(token, start, end).bars(period, start, end))
+
+    def stats(self) -> Dict:
+        return {'instruments': len(self.entries), 'hits': self.hits, 'builds': self.builds}
@@ -0,0 +1,156 @@
+"""Caches for pre-encoded API responses and historical results."""
+import hashlib
+import sys
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from market_time import IST
+
+# NSE cash session, with a margin after the close for the day candle to settle
+MARKET_OPEN = (9, 15)
+MARKET_SETTLED = (16, 0)
+
+
+class PageCache:
+    """LRU of pre-encoded JSON bodies tied to one catalog version.
+
+    Entries are (etag, body) pairs. Asking for a different catalog version
+    drops every cached page, since all of them were built from the old one.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self.pages: 'OrderedDict[Hashable, Tuple[str, bytes]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version: str):
+        if version != self.version:
+            self.pages.clear()
+            self.version = version
+
+    def get(self, version: str, key: Hashable) -> Optional[Tuple[str, bytes]]:
+        self._check_version(version)
+        entry = self.pages.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, version: str, key: Hashable, body: bytes) -> Tuple[str, bytes]:
+        """Store an encoded body and return its (etag, body) entry"""
+        self._check_version(version)
+        etag = f"{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+        entry = (etag, body)
+        self.pages[key] = entry
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.max_entries:
+            self.pages.popitem(last=False)
+        return entry
+
+    def stats(self) -> Dict:
+        return {'version': self.version, 'entries': len(self.pages),
+                'hits': self.hits, 'misses': self.misses}
+
+
+def next_market_open(now: datetime) -> datetime:
+    """The next weekday 09:15 IST strictly after now"""
+    candidate = now.replace(hour=MARKET_OPEN[0], minute=MARKET_OPEN[1], second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def estimate_candles_bytes(candles: List[Dict]) -> int:
+    """Approximate memory held by a list of candle dicts, sampled from its first candle"""
+    if not candles:
+        return sys.getsizeof(candles)
+    sample = candles[0]
+    per_candle = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample.values())
+    return sys.getsizeof(candles) + per_candle * len(candles)
+
+
+class HistoricalCache:
+    """Byte-bounded LRU of candle lists keyed by (token, interval, start, end).
+
+    Ranges that end before today are immutable and never expire. Ranges that
+    include today expire after live_ttl seconds while the market is open (or
+    its day candle is still settling), and otherwise at the next open.
+    Callers get a copy of each candle, so they may reformat them in place.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, live_ttl: float = 30):
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self.entries: 'OrderedDict[Hashable, Tuple[Optional[float], int, List[Dict]]]' = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def expiry(self, end_date: date, now: Optional[datetime] = None) -> Optional[float]:
+        """Epoch second a result whose data runs through end_date stops being valid, or None if it never does"""
+        now = now or datetime.now(IST)
+        if end_date < now.date():
+            return None
+        opens = now.replace(hour=MARKET_OPEN[0], minute=MARKET_OPEN[1], second=0, microsecond=0)
+        settled = now.replace(hour=MARKET_SETTLED[0], minute=MARKET_SETTLED[1], second=0, microsecond=0)
+        if now.weekday() < 5 and opens <= now < settled:
+            return now.timestamp() + self.live_ttl
+        return next_market_open(now).timestamp()
+
+    def _drop(self, key: Hashable):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key: Hashable) -> Optional[List[Dict]]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is not None and time.time() >= entry[0]:
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return [dict(candle) for candle in entry[2]]
+
+    def put(self, key: Hashable, candles: List[Dict], end_date: date):
+        size = estimate_candles_bytes(candles)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (self.expiry(end_date), size, [dict(candle) for candle in candles])
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def get_or_load(self, key: Hashable, end_date: date, load: Callable[[], List[Dict]]) -> List[Dict]:
+        """Cached candles for key, loading and caching them on a miss"""
+        candles = self.get(key)
+        if candles is None:
+            candles = load()
+            self.put(key, candles, end_date)
+        return candles
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+        }
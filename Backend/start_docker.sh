@@ -20,5 +20,8 @@ echo "=== Starting Flask application ==="
 PORT=${PORT:-10000}
 echo "Using port: $PORT"
 
+# Each worker takes 1/WEB_CONCURRENCY of the Kite rate limits
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
+
 # Start the Flask application with gunicorn
-exec gunicorn --bind 0.0.0.0:$PORT app:app --workers 2 --threads 2 
\ No newline at end of file
+exec gunicorn --bind 0.0.0.0:$PORT app:app --workers $WEB_CONCURRENCY --threads 2 
\ No newline at end of file
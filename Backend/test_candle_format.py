@@ -0,0 +1,36 @@
+"""Tests for candle_format.py."""
+from datetime import datetime, timedelta, timezone
+
+from candle_format import candles_to_columns, format_candle_dates
+from market_time import IST
+
+
+def test_format_candle_dates_matches_strftime_in_ist():
+    start = datetime(2023, 12, 29, 9, 15, tzinfo=IST)
+    dates = [start + timedelta(days=day, minutes=minute, seconds=7 * minute)
+             for day in range(5) for minute in range(0, 400, 37)]
+    candles = format_candle_dates([{'date': when} for when in dates])
+
+    assert [c['date'] for c in candles] == [when.strftime('%A, %d %b %Y %H:%M:%S IST') for when in dates]
+
+
+def test_format_candle_dates_accepts_strings_in_other_zones():
+    candles = format_candle_dates([
+        {'date': 'Mon, 01 Jan 2024 03:45:00 GMT'},
+        {'date': '2024-01-01T03:46:00Z'},
+        {'date': datetime(2024, 1, 1, 3, 47, tzinfo=timezone.utc)},
+    ])
+
+    assert [c['date'] for c in candles] == [
+        'Monday, 01 Jan 2024 09:15:00 IST',
+        'Monday, 01 Jan 2024 09:16:00 IST',
+        'Monday, 01 Jan 2024 09:17:00 IST',
+    ]
+
+
+def test_candles_to_columns():
+    when = datetime(2024, 1, 1, 9, 15, tzinfo=IST)
+    columns = candles_to_columns([{'date': when, 'open': 1, 'high': 2, 'low': 0.5, 'close': 1.5, 'volume': 10}])
+
+    assert columns == {'t': [int(when.timestamp())], 'o': [1], 'h': [2], 'l': [0.5], 'c': [1.5], 'v': [10]}
+    assert format_candle_dates([]) == []
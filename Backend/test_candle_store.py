@@ -0,0 +1,103 @@
+"""Tests for the gap bookkeeping in candle_store.py."""
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from candle_store import CandleStore, ist_midnight, range_bounds, subtract_ranges
+from market_time import IST
+
+DAY = 86400
+
+
+def fake_fetch(calls):
+    def fetch(token, interval, from_dt, to_dt):
+        calls.append((from_dt, to_dt))
+        candles = []
+        day = from_dt.date()
+        while day <= to_dt.date():
+            candles.append({'date': datetime(day.year, day.month, day.day, tzinfo=IST),
+                            'open': 1, 'high': 2, 'low': 0.5, 'close': 1.5, 'volume': 10})
+            day += timedelta(days=1)
+        return candles
+    return fetch
+
+
+def test_subtract_ranges_without_coverage_is_the_whole_range():
+    assert subtract_ranges(0, 100, []) == [(0, 100)]
+
+
+def test_subtract_ranges_returns_holes_between_covered_ranges():
+    assert subtract_ranges(0, 100, [(10, 20), (30, 40)]) == [(0, 10), (20, 30), (40, 100)]
+
+
+def test_subtract_ranges_ignores_coverage_outside_the_request():
+    assert subtract_ranges(50, 60, [(0, 10), (20, 55), (70, 80)]) == [(55, 60)]
+
+
+def test_subtract_ranges_fully_covered_has_no_gaps():
+    assert subtract_ranges(10, 20, [(0, 15), (15, 30)]) == []
+
+
+def test_missing_always_includes_todays_session(tmp_path):
+    store = CandleStore(str(tmp_path / 'candles.sqlite3'), fake_fetch([]))
+    today = ist_midnight(datetime.now(IST).date())
+    start, end = int(today.timestamp()) - 2 * DAY, int(today.timestamp()) + DAY
+    store._mark_covered(1, 'day', start, end)
+
+    assert store.missing(1, 'day', start, end) == [(int(today.timestamp()), end)]
+
+
+def test_mark_covered_merges_overlapping_and_touching_ranges(tmp_path):
+    store = CandleStore(str(tmp_path / 'candles.sqlite3'), fake_fetch([]))
+    store._mark_covered(1, 'day', 0, 10)
+    store._mark_covered(1, 'day', 20, 30)
+    store._mark_covered(1, 'day', 10, 20)
+    store._mark_covered(1, 'day', 25, 40)
+    store._mark_covered(2, 'day', 100, 200)
+
+    assert store._covered(1, 'day', 0, 1000) == [(0, 40)]
+    assert store._covered(2, 'day', 0, 1000) == [(100, 200)]
+
+
+def test_get_fetches_only_the_gap_between_stored_ranges(tmp_path):
+    calls = []
+    store = CandleStore(str(tmp_path / 'candles.sqlite3'), fake_fetch(calls))
+    store.get(1, 'day', date(2024, 1, 1), date(2024, 1, 10))
+    store.get(1, 'day', date(2024, 1, 20), date(2024, 1, 31))
+    calls.clear()
+
+    candles = store.get(1, 'day', date(2024, 1, 1), date(2024, 1, 31))
+
+    assert calls == [(datetime(2024, 1, 11), datetime(2024, 1, 19, 23, 59, 59))]
+    assert len(candles) == 31
+
+
+def test_get_serves_from_kite_when_the_database_is_locked(tmp_path):
+    path = str(tmp_path / 'candles.sqlite3')
+    calls = []
+    store = CandleStore(path, fake_fetch(calls), busy_timeout=0.01)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    try:
+        candles = store.get(1, 'day', date(2024, 1, 1), date(2024, 1, 5))
+    finally:
+        other.execute('ROLLBACK')
+
+    assert len(candles) == 5
+    assert store.stats()['bypassed'] == 1
+    start, end = range_bounds(date(2024, 1, 1), date(2024, 1, 5))
+    assert store.missing(1, 'day', start, end) == [(start, end)]
+
+
+def test_opening_waits_for_another_workers_schema_lock(tmp_path):
+    path = str(tmp_path / 'candles.sqlite3')
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    release = threading.Timer(0.2, other.execute, ('ROLLBACK',))
+    release.start()
+    try:
+        store = CandleStore(path, fake_fetch([]), busy_timeout=0.01)
+    finally:
+        release.join()
+
+    assert store.db.execute('PRAGMA busy_timeout').fetchone() == (10,)
@@ -0,0 +1,112 @@
+"""Tests for instrument snapshots and catalog change folding in instrument_store.py."""
+from datetime import date
+
+from instrument_store import (CHANGE_HISTORY_SIZE, InstrumentCatalog, decode_snapshot, encode_snapshot,
+                              load_snapshot, save_snapshot)
+from instruments import InstrumentColumns
+
+
+def row(token, symbol=None, lot_size=1, **extra):
+    fields = {
+        'instrument_token': token, 'exchange_token': str(token // 256), 'tradingsymbol': symbol or f'SYM{token}',
+        'name': f'Company {token}', 'last_price': 10.5, 'expiry': None, 'strike': 0.0, 'tick_size': 0.05,
+        'lot_size': lot_size, 'instrument_type': 'EQ', 'segment': 'NSE', 'exchange': 'NSE',
+    }
+    fields.update(extra)
+    return fields
+
+
+def catalog_with(*versions):
+    """A catalog that has swapped through each list of rows in turn, versioned v0, v1, ..."""
+    catalog = InstrumentCatalog(lambda exchange: [])
+    for number, rows in enumerate(versions):
+        catalog._swap(InstrumentColumns.from_rows(rows), 1000.0 + number, f'v{number}')
+    return catalog
+
+
+def test_snapshot_round_trip():
+    rows = [row(256, 'INFY', name='Infosys'), row(512, 'NIFTY24JANFUT', expiry=date(2024, 1, 25),
+                                                  instrument_type='FUT', segment='NFO-FUT', exchange='NFO')]
+    payload, version = encode_snapshot(InstrumentColumns.from_rows(rows), 1234.5, 'NSE')
+
+    instruments, header = decode_snapshot(payload)
+
+    assert header['version'] == version
+    assert header['fetched_at'] == 1234.5
+    assert list(instruments) == list(InstrumentColumns.from_rows(rows))
+    assert instruments[1]['expiry'] == date(2024, 1, 25)
+
+
+def test_identical_catalogs_get_identical_versions():
+    rows = [row(256), row(512)]
+    assert encode_snapshot(InstrumentColumns.from_rows(rows), 1.0)[1] == \
+        encode_snapshot(InstrumentColumns.from_rows(rows), 2.0)[1]
+    assert encode_snapshot(InstrumentColumns.from_rows(rows), 1.0)[1] != \
+        encode_snapshot(InstrumentColumns.from_rows(rows[:1]), 1.0)[1]
+
+
+def test_empty_snapshot_round_trip():
+    instruments, header = decode_snapshot(encode_snapshot(InstrumentColumns.from_rows([]), 1.0)[0])
+    assert len(instruments) == 0 and header['count'] == 0
+
+
+def test_save_and_load_snapshot(tmp_path):
+    path = str(tmp_path / 'instruments_NSE.bin')
+    version = save_snapshot(path, InstrumentColumns.from_rows([row(256, 'INFY')]), 99.0)
+
+    instruments, header = load_snapshot(path)
+
+    assert header['version'] == version
+    assert instruments[0]['tradingsymbol'] == 'INFY'
+
+
+def test_missing_corrupt_and_truncated_snapshots_are_ignored(tmp_path):
+    payload, _ = encode_snapshot(InstrumentColumns.from_rows([row(token) for token in range(256, 2560, 256)]), 1.0)
+    assert load_snapshot(str(tmp_path / 'missing.bin')) is None
+
+    for name, data in [('garbage.bin', b'not a snapshot at all'),
+                       ('empty.bin', b''),
+                       ('header.bin', payload[:20]),
+                       ('columns.bin', payload[:len(payload) - 64]),
+                       ('flipped.bin', payload[:6] + b'\xff' + payload[7:])]:
+        path = tmp_path / name
+        path.write_bytes(data)
+        assert load_snapshot(str(path)) is None, name
+
+
+def test_changes_since_current_version_is_empty():
+    catalog = catalog_with([row(256)])
+    assert catalog.changes_since('v0') == {'from': 'v0', 'to': 'v0', 'added': [], 'removed': [], 'modified': []}
+
+
+def test_changes_since_folds_several_diffs():
+    catalog = catalog_with(
+        [row(256), row(512), row(768)],
+        # 1024 added, 512 removed, 768 modified
+        [row(256), row(768, lot_size=50), row(1024)],
+        # 1024 modified after being added, 512 re-listed, 1280 added then removed next time
+        [row(256), row(512), row(768, lot_size=50), row(1024, lot_size=5), row(1280)],
+        # 256 removed
+        [row(512), row(768, lot_size=50), row(1024, lot_size=5)],
+    )
+
+    changes = catalog.changes_since('v0')
+
+    assert (changes['from'], changes['to']) == ('v0', 'v3')
+    assert [(r['instrument_token'], r['lot_size']) for r in changes['added']] == [(1024, 5)]
+    assert changes['removed'] == [256]
+    assert sorted((r['instrument_token'], r['lot_size']) for r in changes['modified']) == [(512, 1), (768, 50)]
+
+    later = catalog.changes_since('v2')
+    assert later['added'] == [] and sorted(later['removed']) == [256, 1280] and later['modified'] == []
+
+
+def test_changes_since_an_unknown_or_expired_version_needs_a_resync():
+    versions = [[row(256, lot_size=n)] for n in range(1, CHANGE_HISTORY_SIZE + 3)]
+    catalog = catalog_with(*versions)
+
+    assert len(catalog.history) == CHANGE_HISTORY_SIZE
+    # 32 versions make 31 diffs, of which the oldest has been dropped
+    assert catalog.changes_since('v0') is None
+    assert catalog.changes_since('v1')['modified'][0]['lot_size'] == CHANGE_HISTORY_SIZE + 2
+    assert catalog.changes_since('from-another-deploy') is None
@@ -0,0 +1,125 @@
+"""Tests for kite_scheduler.py."""
+import gevent
+import pytest
+
+import kite_scheduler
+from kite_scheduler import (ENDPOINT_QUOTE, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, KiteScheduler, TokenBucket,
+                            is_rate_limited)
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(kite_scheduler.time, 'monotonic', clock)
+    bucket = TokenBucket(rate=2, burst=1)
+
+    assert bucket.delay() == 0
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 10
+    # Never refills past the burst: one token after a long idle spell, as the dispatcher sees it
+    assert bucket.delay() == 0
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+def test_token_bucket_block_holds_callers_back(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(kite_scheduler.time, 'monotonic', clock)
+    bucket = TokenBucket(rate=10, burst=1)
+
+    bucket.block(3)
+
+    assert bucket.delay() == pytest.approx(3)
+    clock.now += 3
+    assert bucket.delay() == pytest.approx(0)
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(RateLimited())
+    assert is_rate_limited(Exception('Too many requests'))
+    assert not is_rate_limited(Exception('Invalid token'))
+
+
+def test_interactive_calls_overtake_queued_background_calls():
+    scheduler = KiteScheduler({ENDPOINT_QUOTE: 20})
+    order = []
+
+    def call(name, priority):
+        return scheduler.call(ENDPOINT_QUOTE, order.append, name, priority=priority)
+
+    # The first call takes the only token, so the rest queue up behind the limit
+    jobs = [gevent.spawn(call, 'first', PRIORITY_BACKGROUND)]
+    gevent.sleep(0)
+    jobs += [gevent.spawn(call, f'background{i}', PRIORITY_BACKGROUND) for i in range(3)]
+    gevent.sleep(0)
+    jobs += [gevent.spawn(call, f'interactive{i}', PRIORITY_INTERACTIVE) for i in range(2)]
+    gevent.joinall(jobs, raise_error=True)
+
+    assert order == ['first', 'interactive0', 'interactive1', 'background0', 'background1', 'background2']
+
+
+def test_rate_limited_call_backs_off_and_is_retried_ahead_of_later_calls():
+    scheduler = KiteScheduler({ENDPOINT_QUOTE: 100}, backoff_base=0.05)
+    attempts = []
+
+    def flaky(name):
+        attempts.append(name)
+        if name == 'flaky' and attempts.count('flaky') == 1:
+            raise RateLimited('Too many requests')
+        return name
+
+    flaky_job = gevent.spawn(scheduler.call, ENDPOINT_QUOTE, flaky, 'flaky')
+    gevent.sleep(0.005)
+    later_job = gevent.spawn(scheduler.call, ENDPOINT_QUOTE, flaky, 'later')
+    gevent.joinall([flaky_job, later_job], raise_error=True)
+
+    assert flaky_job.value == 'flaky' and later_job.value == 'later'
+    assert attempts == ['flaky', 'flaky', 'later']
+    stats = scheduler.stats()[ENDPOINT_QUOTE]
+    assert stats['throttled'] == 1 and stats['failures'] == 0
+
+
+def test_rate_limited_call_gives_up_after_max_retries():
+    scheduler = KiteScheduler({ENDPOINT_QUOTE: 1000}, max_retries=2, backoff_base=0.001)
+    attempts = []
+
+    def always_limited():
+        attempts.append(1)
+        raise RateLimited('Too many requests')
+
+    with pytest.raises(RateLimited):
+        scheduler.call(ENDPOINT_QUOTE, always_limited)
+    assert len(attempts) == 3
+    assert scheduler.stats()[ENDPOINT_QUOTE]['failures'] == 1
+
+
+def test_other_errors_are_not_retried():
+    scheduler = KiteScheduler({ENDPOINT_QUOTE: 1000})
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError('Invalid instrument')
+
+    with pytest.raises(ValueError):
+        scheduler.call(ENDPOINT_QUOTE, broken)
+    assert len(attempts) == 1
+
+
+def test_unknown_endpoint_class():
+    with pytest.raises(ValueError):
+        KiteScheduler().call('orders', lambda: None)
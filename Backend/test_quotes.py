@@ -0,0 +1,113 @@
+"""Tests for quotes.py."""
+import time
+
+import gevent
+import pytest
+from gevent.event import Event
+
+from quotes import MODE_FULL, MODE_LTP, SOURCE_CACHE, SOURCE_KITE, SOURCE_TICK, QuoteCoalescer, QuoteService
+from tick_state import TickState
+
+INFY = {'exchange': 'NSE', 'tradingsymbol': 'INFY', 'instrument_token': 408065}
+
+
+def kite_quotes(calls):
+    def fetch(keys):
+        calls.append(list(keys))
+        return {key: {'last_price': 100.0, 'ohlc': {'close': 90.0}} for key in keys}
+    return fetch
+
+
+def test_streamed_full_tick_answers_from_tick_state():
+    ticks = TickState()
+    ticks.update(408065, {'last_price': 101.0}, raw={'instrument_token': 408065, 'last_price': 101.0,
+                                                     'ohlc': {'close': 100.0}})
+    calls = []
+    service = QuoteService({MODE_FULL: kite_quotes(calls)}, ticks=ticks)
+
+    quote, source = service.get_quote(INFY)
+
+    assert source == SOURCE_TICK
+    assert quote['last_price'] == 101.0
+    assert calls == []
+
+
+def test_stale_tick_falls_back_to_kite_then_cache():
+    ticks = TickState()
+    ticks.update(408065, {}, raw={'instrument_token': 408065, 'last_price': 1.0, 'ohlc': {}})
+    ticks.raw[408065] = (time.time() - 60, ticks.raw[408065][1])
+    calls = []
+    service = QuoteService({MODE_FULL: kite_quotes(calls)}, ticks=ticks)
+
+    assert service.get_quote(INFY)[1] == SOURCE_KITE
+    # A cached full quote also answers the cheaper ltp mode
+    assert service.get_quote(INFY, MODE_LTP)[1] == SOURCE_CACHE
+    assert calls == [['NSE:INFY']]
+
+
+def test_cache_is_trimmed_to_max_entries_after_a_large_batch():
+    service = QuoteService({MODE_FULL: kite_quotes([])}, max_cache_entries=10)
+    instruments = [{'exchange': 'NSE', 'tradingsymbol': f'S{i}', 'instrument_token': i} for i in range(25)]
+
+    service.get_quotes(instruments)
+
+    assert len(service.cache) == 10
+
+
+def test_concurrent_demands_share_one_call_and_get_only_their_keys():
+    calls = []
+    coalescer = QuoteCoalescer(kite_quotes(calls))
+
+    jobs = [gevent.spawn(coalescer, keys) for keys in (['NSE:A', 'NSE:B'], ['NSE:B', 'NSE:C'], ['NSE:D'])]
+    gevent.joinall(jobs, raise_error=True)
+
+    assert len(calls) == 1 and sorted(calls[0]) == ['NSE:A', 'NSE:B', 'NSE:C', 'NSE:D']
+    assert [sorted(job.value) for job in jobs] == [['NSE:A', 'NSE:B'], ['NSE:B', 'NSE:C'], ['NSE:D']]
+
+
+def test_batches_split_at_max_batch():
+    calls = []
+    coalescer = QuoteCoalescer(kite_quotes(calls), max_batch=3)
+
+    jobs = [gevent.spawn(coalescer, [f'NSE:S{i}' for i in range(5)]),
+            gevent.spawn(coalescer, ['NSE:S1', 'NSE:X'])]
+    gevent.joinall(jobs, raise_error=True)
+
+    # S0-S2 fill the first batch; S3, S4 and the second demand's S1 fill the next; X spills into a third
+    assert [sorted(keys) for keys in calls] == [['NSE:S0', 'NSE:S1', 'NSE:S2'], ['NSE:S1', 'NSE:S3', 'NSE:S4'],
+                                                ['NSE:X']]
+    assert len(jobs[0].value) == 5 and sorted(jobs[1].value) == ['NSE:S1', 'NSE:X']
+    assert coalescer.stats() == {'demands': 2, 'kite_calls': 3}
+
+
+def test_batch_stays_open_until_the_schedule_sends_it():
+    calls = []
+    granted = Event()
+
+    def schedule(send, batch):
+        granted.wait()
+        return send(batch)
+
+    coalescer = QuoteCoalescer(kite_quotes(calls), window=0.001, schedule=schedule)
+    jobs = [gevent.spawn(coalescer, ['NSE:A'])]
+    # Well past the window, but the token has not been granted yet
+    gevent.sleep(0.02)
+    jobs.append(gevent.spawn(coalescer, ['NSE:B']))
+    gevent.sleep(0.01)
+    granted.set()
+    gevent.joinall(jobs, raise_error=True)
+
+    assert len(calls) == 1 and sorted(calls[0]) == ['NSE:A', 'NSE:B']
+
+
+def test_failed_call_raises_in_every_caller():
+    def fail(keys):
+        raise RuntimeError('Kite is down')
+
+    coalescer = QuoteCoalescer(fail)
+    jobs = [gevent.spawn(coalescer, ['NSE:A']), gevent.spawn(coalescer, ['NSE:B'])]
+    gevent.joinall(jobs)
+
+    for job in jobs:
+        with pytest.raises(RuntimeError):
+            job.get()
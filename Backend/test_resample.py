@@ -0,0 +1,101 @@
+"""Tests for resample.py."""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from resample import LevelCache, candles_to_arrays, period_end, resample
+from response_cache import HistoricalCache
+from market_time import IST
+
+
+def daily_candles(start, end):
+    candles = []
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            candles.append({'date': datetime(day.year, day.month, day.day, tzinfo=IST),
+                            'open': day.day, 'high': day.day + 1, 'low': day.day - 1,
+                            'close': day.day + 0.5, 'volume': day.day})
+        day += timedelta(days=1)
+    return candles
+
+
+def loader(candles, calls=None):
+    def load_daily(token, start, end):
+        if calls is not None:
+            calls.append((start, end))
+        return [c for c in candles if start <= c['date'].date() <= end]
+    return load_daily
+
+
+def test_resample_weeks_start_on_monday():
+    bars = candles_to_arrays(daily_candles(date(2024, 1, 1), date(2024, 1, 14)))
+    weeks = resample(bars, 'week')
+
+    assert [datetime.fromtimestamp(ts, IST).date() for ts in weeks['ts'].tolist()] == \
+        [date(2024, 1, 1), date(2024, 1, 8)]
+    assert weeks['open'].tolist() == [1, 8]
+    assert weeks['high'].tolist() == [6, 13]
+    assert weeks['low'].tolist() == [0, 7]
+    assert weeks['close'].tolist() == [5.5, 12.5]
+    assert weeks['volume'].tolist() == [15, 50]
+
+
+def test_resample_months_into_quarters():
+    bars = candles_to_arrays(daily_candles(date(2024, 1, 1), date(2024, 6, 30)))
+    quarters = resample(resample(bars, 'month'), 'quarter')
+
+    assert len(quarters['ts']) == 2
+    assert quarters['volume'].sum() == bars['volume'].sum()
+
+
+def test_resample_empty():
+    bars = candles_to_arrays([])
+    assert all(len(column) == 0 for column in resample(bars, 'year').values())
+
+
+def test_week_spanning_new_year_does_not_depend_on_the_request_end():
+    candles = daily_candles(date(2024, 12, 1), date(2025, 1, 31))
+    new_year_week = int(datetime(2024, 12, 30, tzinfo=IST).timestamp())
+
+    def week_volume(cache, end):
+        bars = cache.levels(1, date(2024, 12, 1), end).bars('week', date(2024, 12, 1), end)
+        return dict(zip(bars['ts'].tolist(), bars['volume'].tolist()))[new_year_week]
+
+    # 30 + 31 Dec and 1, 2, 3 Jan
+    expected = 30 + 31 + 1 + 2 + 3
+    assert week_volume(LevelCache(loader(candles)), date(2024, 12, 31)) == expected
+    assert week_volume(LevelCache(loader(candles)), date(2025, 1, 2)) == expected
+
+    cache = LevelCache(loader(candles))
+    assert week_volume(cache, date(2024, 12, 31)) == expected
+    assert week_volume(cache, date(2025, 1, 2)) == expected
+
+
+def test_level_cache_reuses_closed_years():
+    calls = []
+    cache = LevelCache(loader(daily_candles(date(2023, 1, 1), date(2024, 1, 31)), calls))
+    cache.get(1, 'month', date(2023, 2, 1), date(2023, 5, 31))
+    cache.get(1, 'week', date(2023, 8, 1), date(2023, 9, 30))
+
+    assert len(calls) == 1
+    assert cache.stats() == {'instruments': 1, 'hits': 1, 'builds': 1}
+    assert np.all(np.diff(cache.levels(1, date(2023, 1, 1), date(2023, 12, 31)).levels['day']['ts']) > 0)
+
+
+def test_period_end():
+    assert period_end(date(2024, 12, 31), 'week') == date(2025, 1, 5)
+    assert period_end(date(2024, 2, 10), 'month') == date(2024, 2, 29)
+    assert period_end(date(2024, 11, 3), 'quarter') == date(2024, 12, 31)
+    assert period_end(date(2024, 5, 1), 'year') == date(2024, 12, 31)
+
+
+def test_week_bar_ending_yesterday_is_not_cached_forever():
+    # Wednesday: a week request ending Tuesday still returns this week's live bar
+    now = datetime(2025, 1, 8, 11, 0, tzinfo=IST)
+    yesterday = date(2025, 1, 7)
+    cache = HistoricalCache(live_ttl=30)
+
+    assert cache.expiry(yesterday, now) is None
+    assert cache.expiry(period_end(yesterday, 'week'), now) == now.timestamp() + 30
+    assert cache.expiry(period_end(date(2025, 1, 3), 'week'), now) is None
@@ -0,0 +1,116 @@
+"""Latest tick per instrument, with change tracking for delta broadcasts and per-client subscriptions."""
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Fields that change on every tick without the market moving
+VOLATILE_FIELDS = ('timestamp',)
+
+
+class TickState:
+    """Latest tick payload per instrument token, remembering which ones changed.
+
+    Broadcasts take the changed payloads as a delta; every delta or full
+    snapshot sent is stamped with the next sequence number, so a client can
+    ignore deltas older than its last snapshot. The sequence is shared by
+    all instruments, so a client watching a few of them will see gaps.
+
+    The raw KiteTicker tick behind each payload is kept too, with the time it
+    arrived, so quotes can be answered from the same state that is broadcast.
+    """
+
+    def __init__(self):
+        self.ticks: Dict[int, Dict] = {}
+        self.raw: Dict[int, Tuple[float, Dict]] = {}
+        self.dirty = set()
+        self._sequence = itertools.count(1)
+        self.sequence = 0
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def __contains__(self, token: int) -> bool:
+        return token in self.ticks
+
+    def get(self, token: int) -> Optional[Dict]:
+        return self.ticks.get(token)
+
+    def raw_tick(self, token: int) -> Optional[Tuple[float, Dict]]:
+        """(received_at, raw tick) for an instrument, or None if it has not ticked"""
+        return self.raw.get(token)
+
+    def update(self, token: int, payload: Dict, raw: Optional[Dict] = None):
+        """Store a tick payload, marking the instrument changed unless only volatile fields differ"""
+        previous = self.ticks.get(token)
+        self.ticks[token] = payload
+        if raw is not None:
+            self.raw[token] = (time.time(), raw)
+        if previous is None or any(
+            previous.get(field) != value for field, value in payload.items() if field not in VOLATILE_FIELDS
+        ):
+            self.dirty.add(token)
+
+    def _next_sequence(self) -> int:
+        self.sequence = next(self._sequence)
+        return self.sequence
+
+    def take_delta(self) -> Optional[Tuple[int, List[Dict]]]:
+        """(sequence, payloads) for instruments changed since the last delta, or None if none did"""
+        if not self.dirty:
+            return None
+        dirty, self.dirty = self.dirty, set()
+        return self._next_sequence(), [self.ticks[token] for token in dirty if token in self.ticks]
+
+    def take_snapshot(self) -> Tuple[int, List[Dict]]:
+        """(sequence, payloads) for every instrument; pending changes are folded into it"""
+        self.dirty = set()
+        return self._next_sequence(), list(self.ticks.values())
+
+    def snapshot(self) -> Tuple[int, List[Dict]]:
+        """Every payload stamped with the last sequence sent, for a client joining mid-stream"""
+        return self.sequence, list(self.ticks.values())
+
+
+class TickSubscriptions:
+    """Which Socket.IO clients watch which instruments, mirroring their room membership"""
+
+    def __init__(self):
+        self.by_sid: Dict[str, set] = {}
+        self.by_token: Dict[int, set] = {}
+        self.all_sids = set()
+
+    def subscribe(self, sid: str, tokens: List[int]):
+        self.by_sid.setdefault(sid, set()).update(tokens)
+        for token in tokens:
+            self.by_token.setdefault(token, set()).add(sid)
+
+    def unsubscribe(self, sid: str, tokens: List[int]):
+        watched = self.by_sid.get(sid, set())
+        for token in tokens:
+            watched.discard(token)
+            sids = self.by_token.get(token)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.by_token[token]
+
+    def subscribe_all(self, sid: str):
+        self.all_sids.add(sid)
+
+    def unsubscribe_all(self, sid: str):
+        self.all_sids.discard(sid)
+
+    def drop(self, sid: str):
+        """Forget a disconnected client"""
+        self.unsubscribe(sid, list(self.by_sid.pop(sid, ())))
+        self.all_sids.discard(sid)
+
+    def has_subscribers(self, token: int) -> bool:
+        return token in self.by_token
+
+    def stats(self) -> Dict:
+        return {
+            'clients': len(self.by_sid.keys() | self.all_sids),
+            'watched_instruments': len(self.by_token),
+            'all_instrument_clients': len(self.all_sids),
+        }
@@ -7,6 +7,9 @@ class WebSocketService {
   StreamController<Map<String, dynamic>>? _priceController;
   bool _isConnected = false;
 
+  // Symbols the app is watching, ref-counted so two widgets can share one
+  final Map<String, int> _subscriptions = {};
+
   Timer? _pingTimer;
   Timer? _pongTimeoutTimer;
 
@@ -40,6 +43,10 @@ class WebSocketService {
         _isConnected = true;
         print('Socket.IO connected successfully');
         _startHeartbeat();
+        // Rooms are per connection, so rejoin them after every (re)connect
+        if (_subscriptions.isNotEmpty) {
+          _socket!.emit('subscribe', {'symbols': _subscriptions.keys.toList()});
+        }
       });
 
       _socket!.on('disconnect', (_) {
@@ -61,6 +68,10 @@ class WebSocketService {
         }
       });
 
+      _socket!.on('subscribed', (data) {
+        print('🔔 Subscribed: $data');
+      });
+
       _socket!.on('market_status', (data) {
         print('📡 Market status: $data');
       });
@@ -77,6 +88,28 @@ class WebSocketService {
     }
   }
 
+  /// Receive live ticks for [symbol]; pair every call with [unsubscribe].
+  void subscribe(String symbol) {
+    final count = _subscriptions[symbol] ?? 0;
+    _subscriptions[symbol] = count + 1;
+    if (count == 0 && _socket?.connected == true) {
+      _socket!.emit('subscribe', {'symbols': [symbol]});
+    }
+  }
+
+  void unsubscribe(String symbol) {
+    final count = _subscriptions[symbol];
+    if (count == null) return;
+    if (count > 1) {
+      _subscriptions[symbol] = count - 1;
+      return;
+    }
+    _subscriptions.remove(symbol);
+    if (_socket?.connected == true) {
+      _socket!.emit('unsubscribe', {'symbols': [symbol]});
+    }
+  }
+
   void _startHeartbeat() {
     // Cancel any existing timers before starting new ones
     _pingTimer?.cancel();
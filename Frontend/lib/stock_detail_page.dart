@@ -34,6 +34,7 @@ class _StockDetailPageState extends State<StockDetailPage> {
     _fetchLatestQuote();
     // Connect to WebSocket and listen for live ticks
     WebSocketService.instance.connect();
+    WebSocketService.instance.subscribe(_stock.symbol);
     
     // Check WebSocket connection status
     _isWebSocketConnected = WebSocketService.instance.isConnected;
@@ -79,6 +80,7 @@ class _StockDetailPageState extends State<StockDetailPage> {
   @override
   void dispose() {
     _tickSubscription?.cancel();
+    WebSocketService.instance.unsubscribe(_stock.symbol);
     super.dispose();
   }
 
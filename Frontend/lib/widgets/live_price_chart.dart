@@ -55,6 +55,7 @@ class _LivePriceChartState extends State<LivePriceChart> with TickerProviderStat
     priceData.add(FlSpot(now.millisecondsSinceEpoch / 1000, currentPrice));
     timeData.add(now);
     _checkMarketHours(); // Check if market is open
+    WebSocketService.instance.subscribe(widget.stock.symbol);
     _connectToWebSocket();
     _simulateDataIfNeeded(); // Simulate data if market is closed
   }
@@ -156,6 +157,7 @@ class _LivePriceChartState extends State<LivePriceChart> with TickerProviderStat
   @override
   void dispose() {
     _priceSubscription?.cancel();
+    WebSocketService.instance.unsubscribe(widget.stock.symbol);
     _animationController.dispose();
     super.dispose();
   }